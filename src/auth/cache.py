@@ -0,0 +1,216 @@
+"""
+In-memory caching utilities for authentication data.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry expiration.
+    """
+    
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+        
+        Args:
+            maxsize: The maximum number of entries to keep.
+            ttl: The default time-to-live of an entry in seconds, or None for no expiration.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # When full, no entry expires before this time.monotonic() value
+        self._full_until = 0.0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get an entry from the cache.
+        
+        Args:
+            key: The key of the entry.
+            default: The value to return if the entry is missing or expired.
+        
+        Returns:
+            The cached value, or the default.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                return default
+            
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Add or replace an entry in the cache.
+        
+        Args:
+            key: The key of the entry.
+            value: The value to cache.
+            ttl: The time-to-live of this entry in seconds, or None for the cache default.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """
+        Add or replace an entry without evicting unexpired entries.
+        
+        When the cache is full, all expired entries are dropped first.
+        
+        Args:
+            key: The key of the entry.
+            value: The value to cache.
+            ttl: The time-to-live of this entry in seconds, or None for the cache default.
+        
+        Returns:
+            True if the entry was stored, False if the cache is full.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        now = time.monotonic()
+        expires_at = now + ttl if ttl is not None else None
+        
+        with self._lock:
+            if key not in self._data and not self._make_room(now):
+                return False
+            
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+        
+        return True
+    
+    def is_full(self) -> bool:
+        """
+        Check whether a new entry can only be stored by evicting an unexpired one.
+        
+        Returns:
+            True if the cache is full of unexpired entries, False otherwise.
+        """
+        with self._lock:
+            return not self._make_room(time.monotonic())
+    
+    def _make_room(self, now: float) -> bool:
+        """
+        Drop expired entries if the cache is full.
+        
+        Entries are kept in recency order, not expiry order, so this scans the
+        whole cache. A scan that frees nothing records when the first entry
+        expires, and the cache is reported full until then without scanning.
+        Must be called with the lock held.
+        
+        Args:
+            now: The current time.monotonic() value.
+        
+        Returns:
+            True if there is room for a new entry, False otherwise.
+        """
+        if len(self._data) < self.maxsize:
+            return True
+        
+        if now < self._full_until:
+            return False
+        
+        expired = [
+            key for key, (_, expires_at) in self._data.items()
+            if expires_at is not None and now >= expires_at
+        ]
+        for key in expired:
+            del self._data[key]
+        
+        if len(self._data) < self.maxsize:
+            return True
+        
+        self._full_until = min(
+            (expires_at for _, expires_at in self._data.values() if expires_at is not None),
+            default=float("inf")
+        )
+        return False
+    
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.set(key, value)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def keys(self) -> List[Hashable]:
+        """
+        Get the keys of all unexpired entries.
+        
+        Returns:
+            The keys, least recently used first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [
+                key for key, (_, expires_at) in self._data.items()
+                if expires_at is None or now < expires_at
+            ]
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Remove an entry from the cache.
+        
+        Args:
+            key: The key of the entry.
+            default: The value to return if the entry is missing.
+        
+        Returns:
+            The removed value, or the default.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+        
+        if entry is None:
+            return default
+        
+        return entry[0]
+    
+    def evict(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """
+        Remove all entries matching a predicate.
+        
+        Args:
+            predicate: Called with each key and value; entries for which it returns True are removed.
+        
+        Returns:
+            The number of entries removed.
+        """
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+        
+        return len(keys)
+    
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock:
+            self._data.clear()
@@ -5,17 +5,38 @@ This module defines the base interfaces and common functionality for all authent
 
 import logging
 import time
-import secrets
 import hashlib
 import base64
+import binascii
+import hmac
 import os
+import ssl
+import sys
+import threading
 from abc import ABC, abstractmethod
+from contextvars import ContextVar, Token
 from enum import Enum
-from typing import Dict, List, Any, Optional, Union, Tuple
+from typing import Callable, Dict, List, Any, Optional, Union, Tuple
 from dataclasses import dataclass, field
 import json
 from datetime import datetime, timedelta
-import uuid
+
+from .cache import TTLCache
+
+try:
+    from argon2 import PasswordHasher as Argon2PasswordHasher, Type as Argon2Type
+    from argon2 import low_level as argon2_low_level
+    from argon2.exceptions import VerificationError, InvalidHashError
+    ARGON2_AVAILABLE = True
+except ImportError:
+    ARGON2_AVAILABLE = False
+
+try:
+    from cryptography.hazmat.primitives import hashes as crypto_hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(
@@ -24,7 +45,90 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class AuthMethod(Enum):
+# hashlib (and therefore PBKDF2 and token hashing) runs on OpenSSL, which
+# dispatches SHA-1/SHA-256 to the x86 SHA-NI or ARMv8 crypto extensions at
+# runtime. In containers where CPUID is masked, the detected capabilities can
+# be overridden with the OPENSSL_ia32cap environment variable.
+if ssl.OPENSSL_VERSION_INFO < (1, 1, 1):
+    logger.warning(
+        f"{ssl.OPENSSL_VERSION} may not use SHA CPU extensions; "
+        "password hashing will be slower than necessary"
+    )
+
+# Time of the request being handled, set by the web layer at request entry so
+# every timestamp written while handling one request agrees
+_request_time: ContextVar[Optional[datetime]] = ContextVar("request_time", default=None)
+
+def set_request_time(now: Optional[datetime] = None) -> Token:
+    """
+    Set the time of the request being handled in the current context.
+    
+    Args:
+        now: The request time, or None for the current time.
+        
+    Returns:
+        A token for reset_request_time.
+    """
+    return _request_time.set(now or datetime.now())
+
+def reset_request_time(token: Token) -> None:
+    """
+    Clear the request time set by set_request_time.
+    
+    Args:
+        token: The token returned by set_request_time.
+    """
+    _request_time.reset(token)
+
+def get_request_time(clock: Callable[[], datetime] = datetime.now) -> datetime:
+    """
+    Get the time of the request being handled.
+    
+    Outside a request the clock is read on every call, so long-lived threads
+    never see a stale time.
+    
+    Args:
+        clock: The clock to read when no request time is set.
+        
+    Returns:
+        The request time.
+    """
+    now = _request_time.get()
+    return now if now is not None else clock()
+
+def get_record_timestamp(record: Dict[str, Any], field_name: str) -> Optional[float]:
+    """
+    Get a timestamp from a stored record as seconds since the epoch.
+    
+    Prefers the numeric "<field_name>_ts" value and falls back to parsing the
+    ISO-8601 "<field_name>" string for records written without it.
+    
+    Args:
+        record: The stored record.
+        field_name: The name of the ISO-8601 timestamp field.
+        
+    Returns:
+        The timestamp, or None if the record has no valid value.
+    """
+    timestamp = record.get(f"{field_name}_ts")
+    if timestamp is not None:
+        return timestamp
+    
+    value = record.get(field_name)
+    if not value:
+        return None
+    
+    # Records that have not been through storage yet may hold datetimes
+    if isinstance(value, datetime):
+        return value.timestamp()
+    
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError) as e:
+        logger.error(f"Error parsing {field_name}: {e}")
+        return None
+
+class AuthMethod(str, Enum):
     """Enum representing different authentication methods."""
     PASSWORD = "password"
     OAUTH = "oauth"
@@ -33,7 +137,7 @@ class AuthMethod(Enum):
     TOKEN = "token"
     API_KEY = "api_key"
 
-class AuthStatus(Enum):
+class AuthStatus(str, Enum):
     """Enum representing authentication status."""
     SUCCESS = "success"
     FAILURE = "failure"
@@ -42,7 +146,7 @@ class AuthStatus(Enum):
     EXPIRED = "expired"
     REQUIRES_MFA = "requires_mfa"
 
-@dataclass
+@dataclass(slots=True)
 class UserCredentials:
     """User credentials data."""
     username: str
@@ -56,7 +160,7 @@ class UserCredentials:
     last_password_change: Optional[datetime] = None
     password_history: List[str] = field(default_factory=list)
 
-@dataclass
+@dataclass(slots=True)
 class UserSession:
     """User session data."""
     session_id: str
@@ -69,8 +173,45 @@ class UserSession:
     last_activity: Optional[datetime] = None
     mfa_verified: bool = False
     metadata: Dict[str, Any] = field(default_factory=dict)
+    
+    def to_storage_dict(self, minimal: bool = False) -> Dict[str, Any]:
+        """
+        Convert the session to the record stored by SessionStorage.
+        
+        Datetimes are left for the storage encoder to format.
+        
+        Args:
+            minimal: Whether to leave out optional fields that hold their default
+                value. Readers treat missing fields as the default.
+        
+        Returns:
+            The session record.
+        """
+        last_activity = self.last_activity or self.created_at
+        
+        record = {
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "created_at": self.created_at,
+            "expires_at": self.expires_at,
+            "expires_at_ts": self.expires_at.timestamp(),
+            "is_active": self.is_active,
+            "last_activity_ts": last_activity.timestamp()
+        }
+        
+        optional = {
+            "ip_address": self.ip_address,
+            "user_agent": self.user_agent,
+            "mfa_verified": self.mfa_verified,
+            "metadata": self.metadata
+        }
+        if minimal:
+            optional = {key: value for key, value in optional.items() if value}
+        record.update(optional)
+        
+        return record
 
-@dataclass
+@dataclass(slots=True)
 class AuthResult:
     """Result of an authentication attempt."""
     status: AuthStatus
@@ -246,9 +387,147 @@ class AuthProvider(ABC):
         """
         pass
 
+# Argon2id parameters (OWASP recommended minimum: m=64 MiB, t=2, p=1)
+ARGON2_TIME_COST = 2
+ARGON2_MEMORY_COST = 64 * 1024
+ARGON2_PARALLELISM = 1
+ARGON2_HASH_LEN = 32
+
+if ARGON2_AVAILABLE:
+    _PH = Argon2PasswordHasher(
+        time_cost=ARGON2_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM,
+        hash_len=ARGON2_HASH_LEN,
+        salt_len=16
+    )
+else:
+    _PH = None
+
+# PBKDF2 parameters, used when argon2-cffi is not installed. SHA-512 operates
+# on 64-bit words, so on 64-bit hosts it is cheaper per iteration than SHA-256.
+if sys.maxsize > 2 ** 32:
+    PBKDF2_DIGEST = "sha512"
+    PBKDF2_ITERATIONS = 210000
+else:
+    PBKDF2_DIGEST = "sha256"
+    PBKDF2_ITERATIONS = 600000
+
+# Untagged hashes were created with PBKDF2-HMAC-SHA256 and 100000 iterations
+LEGACY_PBKDF2_DIGEST = "sha256"
+LEGACY_PBKDF2_ITERATIONS = 100000
+
+# hashlib.pbkdf2_hmac is OpenSSL's PKCS5_PBKDF2_HMAC unless CPython was built
+# without OpenSSL, in which case it is a slow pure-Python loop. Prefer the
+# cryptography package (also OpenSSL-backed) in that case.
+_USE_HASHLIB_PBKDF2 = (
+    getattr(hashlib.pbkdf2_hmac, "__module__", None) == "_hashlib"
+    or not CRYPTOGRAPHY_AVAILABLE
+)
+
+def _pbkdf2_fast(hash_name: str, password: bytes, salt: bytes, iterations: int) -> bytes:
+    """
+    Derive a single-block PBKDF2-HMAC key with an OpenSSL-backed implementation.
+    
+    Args:
+        hash_name: The digest name (e.g. "sha512").
+        password: The password bytes.
+        salt: The salt bytes.
+        iterations: The number of iterations.
+        
+    Returns:
+        The derived key, as long as the digest output.
+    """
+    # dklen always equals the digest size, so PBKDF2 computes exactly one
+    # output block and there are no independent blocks to spread over a
+    # thread pool. Reimplementing the per-block iteration loop in Python to
+    # parallelize longer keys would be far slower than OpenSSL's C loop.
+    if _USE_HASHLIB_PBKDF2:
+        return hashlib.pbkdf2_hmac(hash_name, password, salt, iterations)
+    
+    kdf = PBKDF2HMAC(
+        algorithm=getattr(crypto_hashes, hash_name.upper())(),
+        length=hashlib.new(hash_name).digest_size,
+        salt=salt,
+        iterations=iterations
+    )
+    return kdf.derive(password)
+
+# Recent successful verifications, keyed by (password_hash, salt) and holding
+# a keyed digest of the password. Service accounts that authenticate
+# constantly skip the KDF on repeat logins; wrong passwords never match the
+# digest and always pay the full cost. The key never leaves the process.
+VERIFIED_CACHE_SIZE = 8
+VERIFIED_CACHE_TTL = 300
+_VERIFIED_CACHE_KEY = os.urandom(32)
+_verified_cache = TTLCache(maxsize=VERIFIED_CACHE_SIZE, ttl=VERIFIED_CACHE_TTL)
+
+class _RandomPool:
+    """
+    Block of OS randomness handed out in slices, so generating many small
+    salts and tokens costs one getrandom() call per block instead of one
+    per value.
+    """
+    
+    def __init__(self, block_size: int = 4096):
+        """
+        Initialize the pool.
+        
+        Args:
+            block_size: The number of random bytes to fetch at a time.
+        """
+        self.block_size = block_size
+        self._reset()
+    
+    def _reset(self) -> None:
+        """
+        Discard the buffered bytes.
+        
+        Also runs in forked children so they never reuse the parent's bytes.
+        """
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._offset = 0
+    
+    def get(self, n: int) -> bytes:
+        """
+        Get random bytes.
+        
+        Args:
+            n: The number of bytes.
+            
+        Returns:
+            n bytes from the operating system's CSPRNG.
+        """
+        if n > self.block_size:
+            return os.urandom(n)
+        
+        with self._lock:
+            if self._offset + n > len(self._buffer):
+                self._buffer = bytearray(os.urandom(self.block_size))
+                self._offset = 0
+            
+            start = self._offset
+            self._offset += n
+            chunk = bytes(self._buffer[start:self._offset])
+            
+            # Don't keep handed-out bytes around in memory
+            self._buffer[start:self._offset] = bytes(n)
+            return chunk
+
+_random_pool = _RandomPool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_random_pool._reset)
+
 class PasswordHasher:
     """
     Utility class for password hashing and verification.
+    
+    New hashes use Argon2id when argon2-cffi is installed, and tagged PBKDF2
+    hashes ("pbkdf2_<digest>$<iterations>$<hash>") otherwise. Hashes created
+    with the legacy untagged PBKDF2 scheme are still verified and can be
+    upgraded on the next successful login (see needs_rehash).
     """
     
     @staticmethod
@@ -259,15 +538,31 @@ class PasswordHasher:
         Returns:
             A random salt as a base64-encoded string.
         """
-        return base64.b64encode(os.urandom(32)).decode('utf-8')
+        return base64.b64encode(_random_pool.get(32)).decode('utf-8')
+    
+    @staticmethod
+    def _to_bytes(value: Union[str, bytes]) -> bytes:
+        """
+        Encode a password or salt as UTF-8, passing bytes through unchanged.
+        
+        Args:
+            value: The value to encode.
+            
+        Returns:
+            The value as bytes.
+        """
+        if isinstance(value, (bytes, bytearray)):
+            return value
+        
+        return value.encode('utf-8')
     
     @staticmethod
-    def hash_password(password: str, salt: Optional[str] = None) -> Tuple[str, str]:
+    def hash_password(password: Union[str, bytes], salt: Optional[Union[str, bytes]] = None) -> Tuple[str, str]:
         """
         Hash a password with a salt.
         
         Args:
-            password: The password to hash.
+            password: The password to hash, as a string or UTF-8 bytes.
             salt: The salt to use, or None to generate a new one.
             
         Returns:
@@ -275,39 +570,169 @@ class PasswordHasher:
         """
         if salt is None:
             salt = PasswordHasher.generate_salt()
-        else:
+        elif isinstance(salt, (bytes, bytearray)):
+            salt = salt.decode('utf-8')
+        elif not isinstance(salt, str):
             # Ensure salt is a string
             salt = str(salt)
         
-        # Use a strong hashing algorithm (Argon2 would be better, but using PBKDF2 for compatibility)
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt.encode('utf-8'),
-            100000  # Number of iterations
-        )
+        password_bytes = PasswordHasher._to_bytes(password)
+        salt_bytes = salt.encode('utf-8')
         
-        password_hash = base64.b64encode(key).decode('utf-8')
+        if ARGON2_AVAILABLE:
+            # The encoded hash embeds the salt and cost parameters
+            password_hash = argon2_low_level.hash_secret(
+                password_bytes,
+                salt_bytes,
+                time_cost=ARGON2_TIME_COST,
+                memory_cost=ARGON2_MEMORY_COST,
+                parallelism=ARGON2_PARALLELISM,
+                hash_len=ARGON2_HASH_LEN,
+                type=Argon2Type.ID
+            ).decode('ascii')
+            
+            return password_hash, salt
         
-        return password_hash, salt
+        # Fall back to PBKDF2 if argon2-cffi is not installed
+        key = _pbkdf2_fast(PBKDF2_DIGEST, password_bytes, salt_bytes, PBKDF2_ITERATIONS)
+        
+        return PasswordHasher._encode_pbkdf2(PBKDF2_DIGEST, PBKDF2_ITERATIONS, key), salt
     
     @staticmethod
-    def verify_password(password: str, password_hash: str, salt: str) -> bool:
+    def _encode_pbkdf2(digest: str, iterations: int, key: bytes) -> str:
+        """
+        Pack a raw PBKDF2 key into the tagged storage format.
+        
+        Args:
+            digest: The hash function name.
+            iterations: The iteration count.
+            key: The derived key.
+            
+        Returns:
+            The encoded password hash.
+        """
+        encoded_key = base64.b64encode(key).decode('ascii')
+        return f"pbkdf2_{digest}${iterations}${encoded_key}"
+    
+    @staticmethod
+    def verify_password(password: Union[str, bytes], password_hash: str, salt: Union[str, bytes]) -> bool:
         """
         Verify a password against a hash.
         
         Args:
-            password: The password to verify.
+            password: The password to verify, as a string or UTF-8 bytes.
+            password_hash: The hash to verify against.
+            salt: The salt used to generate the hash.
+            
+        Returns:
+            True if the password matches the hash, False otherwise.
+        """
+        # Encode once; both KDF backends accept bytes
+        password_bytes = PasswordHasher._to_bytes(password)
+        
+        cache_key = (password_hash, salt)
+        fingerprint = hashlib.blake2b(password_bytes, key=_VERIFIED_CACHE_KEY).digest()
+        cached = _verified_cache.get(cache_key)
+        if cached is not None and hmac.compare_digest(cached, fingerprint):
+            return True
+        
+        if not PasswordHasher._verify_password_uncached(password_bytes, password_hash, salt):
+            return False
+        
+        _verified_cache.set(cache_key, fingerprint)
+        return True
+    
+    @staticmethod
+    def _verify_password_uncached(password_bytes: bytes, password_hash: str, salt: Union[str, bytes]) -> bool:
+        """
+        Verify a password against a hash by running the KDF.
+        
+        Args:
+            password_bytes: The password to verify, as UTF-8 bytes.
             password_hash: The hash to verify against.
             salt: The salt used to generate the hash.
             
         Returns:
             True if the password matches the hash, False otherwise.
         """
-        calculated_hash, _ = PasswordHasher.hash_password(password, salt)
+        if password_hash.startswith("$argon2"):
+            if not ARGON2_AVAILABLE:
+                logger.error("Argon2 password hash found but argon2-cffi is not installed")
+                return False
+            
+            try:
+                return _PH.verify(password_hash, password_bytes)
+            except (VerificationError, InvalidHashError):
+                return False
+        
+        if password_hash.startswith("pbkdf2_"):
+            try:
+                scheme, iterations, encoded_key = password_hash.split("$", 2)
+                digest = scheme[len("pbkdf2_"):]
+                iterations = int(iterations)
+            except ValueError:
+                logger.error("Malformed PBKDF2 password hash")
+                return False
+        else:
+            # Legacy untagged PBKDF2 hash
+            digest = LEGACY_PBKDF2_DIGEST
+            iterations = LEGACY_PBKDF2_ITERATIONS
+            encoded_key = password_hash
+        
+        try:
+            stored_key = base64.b64decode(encoded_key, validate=True)
+        except (binascii.Error, ValueError):
+            logger.error("Malformed PBKDF2 password hash")
+            return False
+        
+        key = _pbkdf2_fast(digest, password_bytes, PasswordHasher._to_bytes(salt), iterations)
+        
+        # Use constant-time comparison on the raw keys to prevent timing attacks
+        return hmac.compare_digest(key, stored_key)
+    
+    @staticmethod
+    def needs_rehash(password_hash: str) -> bool:
+        """
+        Check whether a password hash should be upgraded to the current scheme.
         
-        # Use constant-time comparison to prevent timing attacks
-        return secrets.compare_digest(calculated_hash, password_hash)
+        Args:
+            password_hash: The stored password hash.
+            
+        Returns:
+            True if the hash was created with outdated parameters, False otherwise.
+        """
+        if not password_hash.startswith("$argon2"):
+            if ARGON2_AVAILABLE:
+                return True
+            
+            return not password_hash.startswith(f"pbkdf2_{PBKDF2_DIGEST}${PBKDF2_ITERATIONS}$")
+        
+        if not ARGON2_AVAILABLE:
+            return False
+        
+        try:
+            return _PH.check_needs_rehash(password_hash)
+        except InvalidHashError:
+            return True
+    
+    @staticmethod
+    def fingerprint(password: Union[str, bytes], pepper: Union[str, bytes]) -> str:
+        """
+        Compute a keyed fingerprint of a password.
+        
+        Fingerprints are cheap to compare and only tell whether two passwords
+        may be equal; a match must still be confirmed with verify_password.
+        
+        Args:
+            password: The password.
+            pepper: The server-side secret key.
+            
+        Returns:
+            The hex HMAC-SHA256 of the password.
+        """
+        return hmac.new(
+            PasswordHasher._to_bytes(pepper), PasswordHasher._to_bytes(password), hashlib.sha256
+        ).hexdigest()
 
 class TokenGenerator:
     """
@@ -325,7 +750,7 @@ class TokenGenerator:
         Returns:
             A random token as a hex string.
         """
-        return secrets.token_hex(length)
+        return _random_pool.get(length).hex()
     
     @staticmethod
     def generate_session_id() -> str:
@@ -335,7 +760,7 @@ class TokenGenerator:
         Returns:
             A random session ID.
         """
-        return str(uuid.uuid4())
+        return _random_pool.get(16).hex()
     
     @staticmethod
     def generate_api_key() -> str:
@@ -345,8 +770,9 @@ class TokenGenerator:
         Returns:
             A random API key.
         """
-        # Format: prefix.random_string
+        # Format: prefix.random_string, where the random part is 160 bits
+        # base32-encoded (20 bytes encode to exactly 32 characters, no padding)
         prefix = "api_"
-        random_part = secrets.token_urlsafe(32)
+        random_part = base64.b32encode(_random_pool.get(20)).decode('ascii')
         
         return f"{prefix}{random_part}" 
\ No newline at end of file
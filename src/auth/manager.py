@@ -3,21 +3,47 @@ Authentication manager for the AI-powered data retrieval application.
 """
 
 import logging
+import time
 from typing import Dict, List, Any, Optional, Union, Tuple
 from datetime import datetime, timedelta
 
 from .core import (
     AuthProvider, AuthResult, AuthStatus, UserSession, UserCredentials,
-    TokenGenerator, AuthMethod
+    TokenGenerator, AuthMethod, get_record_timestamp
 )
-from .storage import UserStorage, SessionStorage
+from .cache import TTLCache
+from .storage import UserStorage, SessionStorage, StateStore
 from .password_auth import PasswordAuthProvider
-from .oauth_auth import OAuthAuthProvider, OAuthProvider
-from .saml_auth import SAMLAuthProvider, SAMLProvider
 from .mfa import MFAManager, TOTPMethod, EmailMethod
 
 logger = logging.getLogger(__name__)
 
+# Provider config keys, split into required and optional
+_OAUTH_REQUIRED_FIELDS = (
+    "provider_id", "name", "client_id", "client_secret", "authorize_url",
+    "token_url", "userinfo_url", "scope", "redirect_uri"
+)
+_OAUTH_OPTIONAL_FIELDS = ("additional_params", "jwks_uri", "issuer")
+_SAML_REQUIRED_FIELDS = ("provider_id", "name", "entity_id", "acs_url")
+_SAML_OPTIONAL_FIELDS = ("metadata_url", "metadata_file", "attribute_mapping", "additional_params")
+
+def _provider_kwargs(provider_config: Dict[str, Any], required: Tuple[str, ...],
+                     optional: Tuple[str, ...]) -> Dict[str, Any]:
+    """
+    Build provider constructor arguments from a provider config.
+    
+    Args:
+        provider_config: The provider configuration.
+        required: Keys that must be present.
+        optional: Keys that default to None.
+        
+    Returns:
+        The keyword arguments.
+    """
+    kwargs = {key: provider_config[key] for key in required}
+    kwargs.update({key: provider_config.get(key) for key in optional})
+    return kwargs
+
 class AuthManager:
     """
     Authentication manager.
@@ -32,6 +58,18 @@ class AuthManager:
         """
         self.config = config
         
+        # Minimum number of seconds between persisted last_activity updates
+        session_config = config.get("session", {})
+        self.activity_write_interval = session_config.get("activity_write_interval", 60)
+        
+        # Short-lived cache for the session validation hot path. A session logged
+        # out or revoked by another process stays valid here for up to
+        # cache.ttl_seconds.
+        cache_config = config.get("cache", {})
+        cache_size = cache_config.get("max_size", 10000)
+        cache_ttl = cache_config.get("ttl_seconds", 30)
+        self._session_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        
         # Initialize storage
         storage_config = config.get("storage", {})
         self._init_storage(storage_config)
@@ -62,7 +100,10 @@ class AuthManager:
         # Session storage
         session_storage_config = config.get("session", {})
         session_storage_dir = session_storage_config.get("directory", "data/sessions")
-        session_storage_provider = FileStorageProvider(session_storage_dir)
+        session_storage_provider = FileStorageProvider(
+            session_storage_dir,
+            pretty=session_storage_config.get("pretty", False)
+        )
         self.session_storage = SessionStorage(session_storage_provider)
     
     def _init_auth_providers(self, config: Dict[str, Any]) -> None:
@@ -80,59 +121,78 @@ class AuthManager:
             self.auth_providers[AuthMethod.PASSWORD] = PasswordAuthProvider(
                 self.user_storage,
                 self.session_storage,
-                password_config
+                password_config,
+                activity_write_interval=self.activity_write_interval
             )
         
         # OAuth authentication
         oauth_config = config.get("oauth", {})
         if oauth_config.get("enabled", False):
-            oauth_providers = []
+            from .oauth_auth import OAuthAuthProvider, OAuthProvider
             
-            for provider_config in oauth_config.get("providers", []):
-                oauth_providers.append(OAuthProvider(
-                    provider_id=provider_config["provider_id"],
-                    name=provider_config["name"],
-                    client_id=provider_config["client_id"],
-                    client_secret=provider_config["client_secret"],
-                    authorize_url=provider_config["authorize_url"],
-                    token_url=provider_config["token_url"],
-                    userinfo_url=provider_config["userinfo_url"],
-                    scope=provider_config["scope"],
-                    redirect_uri=provider_config["redirect_uri"],
-                    additional_params=provider_config.get("additional_params")
+            oauth_providers = [
+                OAuthProvider(**_provider_kwargs(
+                    provider_config, _OAUTH_REQUIRED_FIELDS, _OAUTH_OPTIONAL_FIELDS
                 ))
+                for provider_config in oauth_config.get("providers", [])
+            ]
             
             self.auth_providers[AuthMethod.OAUTH] = OAuthAuthProvider(
                 self.user_storage,
                 self.session_storage,
                 oauth_providers,
-                oauth_config.get("session_duration_minutes", 60)
+                oauth_config.get("session_duration_minutes", 60),
+                activity_write_interval=self.activity_write_interval,
+                state_store=self._create_state_store(oauth_config.get("state_store", {}))
             )
         
         # SAML authentication
         saml_config = config.get("saml", {})
         if saml_config.get("enabled", False):
-            saml_providers = []
+            from .saml_auth import SAMLAuthProvider, SAMLProvider
             
-            for provider_config in saml_config.get("providers", []):
-                saml_providers.append(SAMLProvider(
-                    provider_id=provider_config["provider_id"],
-                    name=provider_config["name"],
-                    metadata_url=provider_config.get("metadata_url"),
-                    metadata_file=provider_config.get("metadata_file"),
-                    entity_id=provider_config["entity_id"],
-                    acs_url=provider_config["acs_url"],
-                    attribute_mapping=provider_config.get("attribute_mapping"),
-                    additional_params=provider_config.get("additional_params")
+            saml_providers = [
+                SAMLProvider(**_provider_kwargs(
+                    provider_config, _SAML_REQUIRED_FIELDS, _SAML_OPTIONAL_FIELDS
                 ))
+                for provider_config in saml_config.get("providers", [])
+            ]
             
             self.auth_providers[AuthMethod.SAML] = SAMLAuthProvider(
                 self.user_storage,
                 self.session_storage,
                 saml_providers,
-                saml_config.get("session_duration_minutes", 60)
+                saml_config.get("session_duration_minutes", 60),
+                activity_write_interval=self.activity_write_interval
             )
     
+    def _create_state_store(self, config: Dict[str, Any]) -> Optional[StateStore]:
+        """
+        Create the store for authorization flow state.
+        
+        Args:
+            config: The state store configuration.
+            
+        Returns:
+            The state store, or None for the provider's in-process default.
+        """
+        store_type = config.get("type", "memory")
+        
+        if store_type == "redis":
+            import redis
+            from .storage import RedisStateStore
+            return RedisStateStore(redis.Redis.from_url(config.get("url", "redis://localhost:6379/0")))
+        
+        if store_type == "memcached":
+            from pymemcache.client.base import Client
+            from .storage import MemcachedStateStore
+            return MemcachedStateStore(Client(config.get("server", "localhost:11211")))
+        
+        if store_type != "memory":
+            logger.warning(f"Unknown state store type '{store_type}', using in-memory state")
+        
+        return None
+    
     def _init_mfa(self, config: Dict[str, Any]) -> None:
         """
         Initialize multi-factor authentication.
@@ -145,14 +205,21 @@ class AuthManager:
         # TOTP method
         totp_config = config.get("totp", {})
         if totp_config.get("enabled", True):
-            self.mfa_manager.register_method(TOTPMethod(self.user_storage))
+            self.mfa_manager.register_method(TOTPMethod(
+                self.user_storage,
+                algorithm=totp_config.get("algorithm", "SHA256")
+            ))
         
         # Email method
         email_config = config.get("email", {})
         if email_config.get("enabled", True):
             from ..email import EmailSender
             email_sender = EmailSender(email_config)
-            self.mfa_manager.register_method(EmailMethod(self.user_storage, email_sender))
+            self.mfa_manager.register_method(EmailMethod(
+                self.user_storage,
+                email_sender,
+                strict_uniform=email_config.get("strict_uniform", False)
+            ))
     
     def authenticate(self, method: AuthMethod, credentials: Dict[str, Any]) -> AuthResult:
         """
@@ -166,22 +233,19 @@ class AuthManager:
             The result of the authentication attempt.
         """
         # Check if method is supported
-        if method not in self.auth_providers:
+        provider = self.auth_providers.get(method)
+        if provider is None:
             return AuthResult(
                 status=AuthStatus.FAILURE,
                 message=f"Unsupported authentication method: {method}"
             )
         
-        provider = self.auth_providers[method]
-        
         # Authenticate
         result = provider.authenticate(credentials)
         
         # Check if MFA is required
         if result.status == AuthStatus.SUCCESS and result.user_id:
-            user = self.user_storage.get(result.user_id)
-            
-            if user and user.get("mfa_enabled", False):
+            if self.user_storage.is_mfa_enabled(result.user_id):
                 # Get available MFA methods
                 mfa_methods = self.mfa_manager.get_available_methods(result.user_id)
                 
@@ -203,39 +267,41 @@ class AuthManager:
         Returns:
             True if the session is valid, False otherwise.
         """
-        session = self.session_storage.get(session_id)
-        
-        if not session:
-            return False
+        cached = self._session_cache.get(session_id)
+        if cached is None:
+            session = self.session_storage.get(session_id)
+            
+            if not session:
+                return False
+            
+            # Check if session is active
+            if not session.get("is_active", False):
+                return False
+            
+            expiration = get_record_timestamp(session, "expires_at")
+            if expiration is None:
+                return False
+            
+            last_activity = get_record_timestamp(session, "last_activity") or 0
+            cached = (expiration, session.get("user_id"), session.get("mfa_verified", False), last_activity)
+            self._session_cache[session_id] = cached
         
-        # Check if session is active
-        if not session.get("is_active", False):
-            return False
+        expiration, user_id, mfa_verified, last_activity = cached
         
         # Check if session has expired
-        expires_at = session.get("expires_at")
-        if not expires_at:
-            return False
-        
-        try:
-            expiration = datetime.fromisoformat(expires_at)
-            if datetime.now() > expiration:
-                return False
-        except Exception as e:
-            logger.error(f"Error parsing expiration date: {e}")
+        now = time.time()
+        if now > expiration:
+            self._session_cache.pop(session_id)
             return False
         
         # Check if MFA is required but not verified
-        user_id = session.get("user_id")
-        if user_id:
-            user = self.user_storage.get(user_id)
-            
-            if user and user.get("mfa_enabled", False) and not session.get("mfa_verified", False):
-                return False
+        if user_id and not mfa_verified and self.user_storage.is_mfa_enabled(user_id):
+            return False
         
-        # Update last activity
-        session["last_activity"] = datetime.now().isoformat()
-        self.session_storage.update(session_id, session)
+        # Update last activity, persisting at most once per write interval
+        if now - last_activity >= self.activity_write_interval:
+            self.session_storage.update_many({session_id: {"last_activity_ts": now}})
+            self._session_cache[session_id] = (expiration, user_id, mfa_verified, now)
         
         return True
     
@@ -256,6 +322,7 @@ class AuthManager:
         
         # Mark session as inactive
         session["is_active"] = False
+        self._session_cache.pop(session_id)
         
         return self.session_storage.update(session_id, session)
     
@@ -283,7 +350,35 @@ class AuthManager:
         Returns:
             True if the response is valid, False otherwise.
         """
-        return self.mfa_manager.verify_response(user_id, response)
+        if not self.mfa_manager.verify_response(user_id, response):
+            return False
+        
+        # Sessions were marked MFA verified in storage
+        self.invalidate_user(user_id)
+        
+        return True
+    
+    def invalidate_user(self, user_id: str) -> None:
+        """
+        Drop cached sessions for a user.
+        
+        Must be called after the user's sessions are changed outside the manager.
+        
+        Args:
+            user_id: The user ID.
+        """
+        self._session_cache.evict(lambda _, cached: cached[1] == user_id)
+    
+    def shutdown(self) -> None:
+        """
+        Shut down the authentication manager.
+        """
+        for provider in self.auth_providers.values():
+            if hasattr(provider, "shutdown"):
+                provider.shutdown()
+        
+        self.user_storage.close()
+        self.session_storage.close()
     
     def cleanup_expired_sessions(self) -> int:
         """
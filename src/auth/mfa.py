@@ -4,8 +4,8 @@ Multi-factor authentication support for the AI-powered data retrieval applicatio
 
 import logging
 import time
-from typing import Dict, List, Any, Optional, Union, Tuple
-from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Any, NamedTuple, Optional, Union, Tuple
+from datetime import datetime
 import json
 import os
 import re
@@ -13,22 +13,105 @@ import base64
 import secrets
 import hashlib
 import hmac
-import struct
-from urllib.parse import urlencode
+from urllib.parse import quote
 
 from .core import (
     AuthProvider, AuthResult, AuthStatus, UserSession, UserCredentials,
     TokenGenerator
 )
+from .cache import TTLCache
 from .storage import UserStorage, SessionStorage
 
 logger = logging.getLogger(__name__)
 
+# Lifetime of email codes and MFA challenges, in seconds
+CHALLENGE_TTL_SECONDS = 600
+
+# Maximum number of outstanding email codes or MFA challenges
+MAX_PENDING_CHALLENGES = 100000
+
+# How long a decoded TOTP key may be reused without reloading the user
+KEY_CACHE_TTL_SECONDS = 300
+
+_SIX_DIGITS = re.compile(r"\A[0-9]{6}\Z")
+
+# Supported TOTP HMAC algorithms (RFC 6238), by otpauth URI name
+TOTP_ALGORITHMS = {
+    "SHA1": hashlib.sha1,
+    "SHA256": hashlib.sha256,
+    "SHA512": hashlib.sha512
+}
+
+# Algorithm assumed for enrollments that predate per-user algorithms
+LEGACY_TOTP_ALGORITHM = "SHA1"
+
+class TOTPState(NamedTuple):
+    """TOTP enrollment of a user."""
+    secret: str
+    secret_raw: Optional[str]
+    verified: bool
+    algorithm: str
+
+def _get_totp(user: Dict[str, Any]) -> Optional[TOTPState]:
+    """
+    Get the TOTP enrollment stored on a user record.
+    
+    Args:
+        user: The user data.
+        
+    Returns:
+        The TOTP state, or None if the user has no TOTP secret.
+    """
+    mfa_data = user.get("mfa")
+    totp_data = mfa_data.get("totp") if mfa_data else None
+    if not totp_data or not totp_data.get("secret"):
+        return None
+    
+    return TOTPState(
+        totp_data["secret"],
+        totp_data.get("secret_raw"),
+        totp_data.get("verified", False),
+        totp_data.get("algorithm", LEGACY_TOTP_ALGORITHM)
+    )
+
+def _make_totp_fn(period: int = 30, digits: int = 6) -> Callable[["hmac.HMAC", int], str]:
+    """
+    Build a TOTP code generator with the period and digit count baked in.
+    
+    Args:
+        period: The time step in seconds.
+        digits: The number of digits in a code.
+        
+    Returns:
+        A function taking an HMAC object keyed with the TOTP key (and no
+        data) and a Unix timestamp, and returning the code.
+    """
+    modulus = 10 ** digits
+    code_format = f"0{digits}d"
+    
+    def generate_totp(base: "hmac.HMAC", timestamp: int, _from_bytes=int.from_bytes, _format=format) -> str:
+        # Calculate counter value (RFC 6238) and HMAC from the prepared key
+        # schedule. The hashing runs in OpenSSL; only a few bytecodes of glue
+        # remain in Python, so a JIT-compiled hash would be slower, not faster.
+        mac = base.copy()
+        mac.update((timestamp // period).to_bytes(8, "big"))
+        h = mac.digest()
+        
+        # Dynamic truncation (RFC 4226)
+        offset = h[-1] & 0x0F
+        binary = _from_bytes(h[offset:offset + 4], "big") & 0x7FFFFFFF
+        
+        return _format(binary % modulus, code_format)
+    
+    return generate_totp
+
 class MFAMethod:
     """
     Base class for MFA methods.
     """
     
+    __slots__ = ("method_id", "name")
+    
     def __init__(self, method_id: str, name: str):
         """
         Initialize the MFA method.
@@ -71,15 +154,38 @@ class TOTPMethod(MFAMethod):
     Time-based One-Time Password (TOTP) MFA method.
     """
     
-    def __init__(self, user_storage: UserStorage):
+    __slots__ = ("user_storage", "algorithm", "_pending_setup", "_key_cache")
+    
+    # Provisioning URI parameters that are the same for every user
+    _STATIC_QS = "digits=6&period=30"
+    
+    def __init__(self, user_storage: UserStorage, algorithm: str = "SHA256"):
         """
         Initialize the TOTP method.
         
         Args:
             user_storage: The user storage.
+            algorithm: The HMAC algorithm for new enrollments ("SHA1", "SHA256"
+                or "SHA512"). Existing enrollments keep the algorithm they
+                were set up with. Authy and older Google Authenticator
+                releases ignore the algorithm parameter and always use SHA1;
+                deployments that must support them should use "SHA1".
+                Current Google Authenticator, 1Password and Microsoft
+                Authenticator honour SHA256.
         """
         super().__init__("totp", "Time-based One-Time Password")
+        
+        if algorithm not in TOTP_ALGORITHMS:
+            raise ValueError(f"Unsupported TOTP algorithm: {algorithm}")
+        
         self.user_storage = user_storage
+        self.algorithm = algorithm
+        
+        # Secrets handed out by setup and not yet verified: user_id -> (secret, secret_raw, algorithm)
+        self._pending_setup = TTLCache(maxsize=10000, ttl=CHALLENGE_TTL_SECONDS)
+        
+        # Decoded keys of enrolled users: user_id -> (key, algorithm)
+        self._key_cache = TTLCache(maxsize=10000, ttl=KEY_CACHE_TTL_SECONDS)
     
     def generate_challenge(self, user_id: str) -> Dict[str, Any]:
         """
@@ -110,23 +216,59 @@ class TOTPMethod(MFAMethod):
         Returns:
             True if the response is valid, False otherwise.
         """
+        loaded = self._load_key(user_id)
+        if loaded is None:
+            return False
+        
+        # Verify TOTP code
+        key, algorithm = loaded
+        return self._verify_totp_key(key, response, algorithm)
+    
+    def invalidate(self, user_id: str) -> None:
+        """
+        Drop the cached TOTP key of a user.
+        
+        Must be called when a user's TOTP secret is changed or removed
+        outside this method.
+        
+        Args:
+            user_id: The user ID.
+        """
+        self._key_cache.pop(user_id)
+    
+    def _load_key(self, user_id: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Get the decoded TOTP key of a user, loading the user only on a cache miss.
+        
+        Args:
+            user_id: The user ID.
+            
+        Returns:
+            A tuple of (key, algorithm), or None if the user has no usable TOTP secret.
+        """
+        loaded = self._key_cache.get(user_id)
+        if loaded is not None:
+            return loaded
+        
         # Get user
         user = self.user_storage.get(user_id)
         if not user:
             logger.error(f"User with ID '{user_id}' not found")
-            return False
+            return None
         
         # Get TOTP secret
-        mfa_data = user.get("mfa", {})
-        totp_data = mfa_data.get("totp", {})
-        secret = totp_data.get("secret")
-        
-        if not secret:
+        totp = _get_totp(user)
+        if totp is None:
             logger.error(f"TOTP not set up for user '{user_id}'")
-            return False
+            return None
         
-        # Verify TOTP code
-        return self._verify_totp(secret, response)
+        key = self._decode_key(totp.secret, totp.secret_raw)
+        if key is None:
+            return None
+        
+        loaded = (key, totp.algorithm)
+        self._key_cache[user_id] = loaded
+        return loaded
     
     def setup(self, user_id: str) -> Dict[str, Any]:
         """
@@ -154,20 +296,25 @@ class TOTPMethod(MFAMethod):
         # Create provisioning URI for QR code
         provisioning_uri = self._get_provisioning_uri(secret, email, "AI Data Retrieval")
         
-        # Update user with TOTP data
-        if "mfa" not in user:
-            user["mfa"] = {}
+        # Raw key as hex, so verification doesn't need to base32-decode
+        secret_raw = base64.b32decode(secret).hex()
         
-        user["mfa"]["totp"] = {
+        # Update user with TOTP data, writing only the TOTP subtree
+        totp_data = {
             "secret": secret,
-            "created_at": datetime.now().isoformat(),
+            "secret_raw": secret_raw,
+            "algorithm": self.algorithm,
+            "created_at_ts": time.time(),
             "verified": False
         }
         
-        if not self.user_storage.update(user_id, user):
+        if not self.user_storage.patch(user_id, {"mfa.totp": totp_data}):
             logger.error(f"Failed to update user with TOTP data")
             return {}
         
+        self._pending_setup[user_id] = (secret, secret_raw, self.algorithm)
+        self.invalidate(user_id)
+        
         return {
             "secret": secret,
             "provisioning_uri": provisioning_uri
@@ -184,6 +331,14 @@ class TOTPMethod(MFAMethod):
         Returns:
             True if the setup is verified, False otherwise.
         """
+        # A recent setup lets us reject wrong codes without loading the user.
+        # Setup may have been run again elsewhere, so the next try reads the
+        # stored secret.
+        pending = self._pending_setup.get(user_id)
+        if pending is not None and not self._verify_totp(pending[0], code, pending[1], pending[2]):
+            self._pending_setup.pop(user_id)
+            return False
+        
         # Get user
         user = self.user_storage.get(user_id)
         if not user:
@@ -191,26 +346,26 @@ class TOTPMethod(MFAMethod):
             return False
         
         # Get TOTP data
-        mfa_data = user.get("mfa", {})
-        totp_data = mfa_data.get("totp", {})
-        secret = totp_data.get("secret")
-        
-        if not secret:
+        totp = _get_totp(user)
+        if totp is None:
             logger.error(f"TOTP not set up for user '{user_id}'")
             return False
         
-        # Verify TOTP code
-        if not self._verify_totp(secret, code):
-            return False
-        
-        # Mark as verified
-        user["mfa"]["totp"]["verified"] = True
-        user["mfa"]["totp"]["verified_at"] = datetime.now().isoformat()
-        
-        # Enable MFA for user
-        user["mfa_enabled"] = True
-        
-        return self.user_storage.update(user_id, user)
+        # Verify TOTP code, unless it was already checked against the same secret
+        if pending is None or pending[0] != totp.secret:
+            self._pending_setup.pop(user_id)
+            if not self._verify_totp(totp.secret, code, totp.secret_raw, totp.algorithm):
+                return False
+        
+        self._pending_setup.pop(user_id)
+        self.invalidate(user_id)
+        
+        # Mark as verified and enable MFA for user, writing only those fields
+        return self.user_storage.patch(user_id, {
+            "mfa.totp.verified": True,
+            "mfa.totp.verified_at_ts": time.time(),
+            "mfa_enabled": True
+        })
     
     def _generate_secret(self) -> str:
         """
@@ -237,96 +392,130 @@ class TOTPMethod(MFAMethod):
         Returns:
             The provisioning URI.
         """
-        params = {
-            "secret": secret,
-            "issuer": issuer,
-            "algorithm": "SHA1",
-            "digits": "6",
-            "period": "30"
-        }
+        # The secret is base32 and needs no escaping
+        quoted_issuer = quote(issuer, safe="")
         
-        uri = f"otpauth://totp/{issuer}:{username}?{urlencode(params)}"
-        
-        return uri
+        return (
+            f"otpauth://totp/{quoted_issuer}:{quote(username, safe='@')}"
+            f"?secret={secret}&issuer={quoted_issuer}"
+            f"&algorithm={self.algorithm}&{self._STATIC_QS}"
+        )
     
-    def _verify_totp(self, secret: str, code: str) -> bool:
+    def _verify_totp(self, secret: str, code: str, secret_raw: Optional[str] = None,
+                     algorithm: str = LEGACY_TOTP_ALGORITHM) -> bool:
         """
         Verify a TOTP code.
         
         Args:
             secret: The TOTP secret.
             code: The TOTP code to verify.
+            secret_raw: The raw TOTP key as hex, if stored.
+            algorithm: The HMAC algorithm the secret was enrolled with.
             
         Returns:
             True if the code is valid, False otherwise.
         """
-        # Clean up code
-        code = code.strip().replace(" ", "")
-        
-        # Check if code is valid
-        if not code.isdigit() or len(code) != 6:
+        key = self._decode_key(secret, secret_raw)
+        if key is None:
             return False
         
-        # Decode secret
+        return self._verify_totp_key(key, code, algorithm)
+    
+    def _decode_key(self, secret: str, secret_raw: Optional[str] = None) -> Optional[bytes]:
+        """
+        Decode a stored TOTP secret.
+        
+        Args:
+            secret: The TOTP secret.
+            secret_raw: The raw TOTP key as hex, if stored.
+            
+        Returns:
+            The key, or None if the secret can't be decoded.
+        """
+        # Prefer the raw key stored at setup
         try:
-            key = base64.b32decode(secret)
+            if secret_raw:
+                return bytes.fromhex(secret_raw)
+            return base64.b32decode(secret)
         except Exception as e:
             logger.error(f"Error decoding TOTP secret: {e}")
-            return False
-        
-        # Get current timestamp
-        now = int(time.time())
-        
-        # Check codes for current time and adjacent intervals
-        for offset in [-1, 0, 1]:
-            if self._generate_totp(key, now + offset * 30) == code:
-                return True
-        
-        return False
+            return None
     
-    def _generate_totp(self, key: bytes, timestamp: int) -> str:
+    def _verify_totp_key(self, key: bytes, code: str, algorithm: str = LEGACY_TOTP_ALGORITHM) -> bool:
         """
-        Generate a TOTP code.
+        Verify a TOTP code against a decoded key.
         
         Args:
             key: The TOTP key.
-            timestamp: The timestamp.
+            code: The TOTP code to verify.
+            algorithm: The HMAC algorithm the key was enrolled with.
             
         Returns:
-            The generated TOTP code.
+            True if the code is valid, False otherwise.
         """
-        # Calculate counter value (RFC 6238)
-        counter = struct.pack(">Q", timestamp // 30)
+        digestmod = TOTP_ALGORITHMS.get(algorithm)
+        if digestmod is None:
+            logger.error(f"Unsupported TOTP algorithm: {algorithm}")
+            return False
         
-        # Calculate HMAC-SHA1
-        h = hmac.new(key, counter, hashlib.sha1).digest()
+        # Clean up code; authenticator apps usually submit it without spaces
+        code = code.strip()
+        if " " in code:
+            code = code.replace(" ", "")
         
-        # Dynamic truncation (RFC 4226)
-        offset = h[-1] & 0x0F
-        binary = ((h[offset] & 0x7F) << 24) | ((h[offset + 1] & 0xFF) << 16) | ((h[offset + 2] & 0xFF) << 8) | (h[offset + 3] & 0xFF)
+        # Check if code is valid (ASCII digits only, unlike str.isdigit)
+        if not _SIX_DIGITS.match(code):
+            return False
         
-        # Generate 6-digit code
-        return str(binary % 1000000).zfill(6)
+        # Get current timestamp
+        now = int(time.time())
+        
+        # Key the HMAC once; each window works on a copy of the keyed state
+        base = hmac.new(key, None, digestmod)
+        
+        # Check codes for current time and adjacent intervals. All windows are
+        # always computed and compared in constant time so the response time
+        # doesn't depend on which window (or how much of a code) matched.
+        generate_totp = self._generate_totp
+        candidates = [generate_totp(base, now + offset * 30) for offset in (-1, 0, 1)]
+        
+        valid = 0
+        for candidate in candidates:
+            valid |= hmac.compare_digest(candidate, code)
+        
+        return valid == 1
+    
+    # Specialized for the standard 30-second period and 6 digits
+    _generate_totp = staticmethod(_make_totp_fn())
 
 class EmailMethod(MFAMethod):
     """
     Email-based MFA method.
     """
     
-    def __init__(self, user_storage: UserStorage, email_sender: Any):
+    __slots__ = ("user_storage", "email_sender", "strict_uniform", "code_storage")
+    
+    # Masks for usernames of common lengths
+    _STARS = tuple("*" * i for i in range(33))
+    
+    def __init__(self, user_storage: UserStorage, email_sender: Any, strict_uniform: bool = False):
         """
         Initialize the email method.
         
         Args:
             user_storage: The user storage.
             email_sender: The email sender.
+            strict_uniform: Whether codes must be exactly uniformly distributed.
+                By default codes are reduced from 24 random bits, which skews
+                the distribution by ~1e-8 per code.
         """
         super().__init__("email", "Email Verification")
         self.user_storage = user_storage
         self.email_sender = email_sender
+        self.strict_uniform = strict_uniform
         
         # Code storage
-        self.code_storage = {}  # user_id -> {"code": str, "expires_at": datetime}
+        self.code_storage = TTLCache(maxsize=MAX_PENDING_CHALLENGES, ttl=CHALLENGE_TTL_SECONDS)  # user_id -> code
     
     def generate_challenge(self, user_id: str) -> Dict[str, Any]:
         """
@@ -353,12 +542,8 @@ class EmailMethod(MFAMethod):
         # Generate code
         code = self._generate_code()
         
-        # Store code with expiration
-        expiration = datetime.now() + timedelta(minutes=10)
-        self.code_storage[user_id] = {
-            "code": code,
-            "expires_at": expiration
-        }
+        # Store code; the cache expires it
+        self.code_storage[user_id] = code
         
         # Send email
         try:
@@ -370,7 +555,8 @@ class EmailMethod(MFAMethod):
         return {
             "method_id": self.method_id,
             "email": self._mask_email(email),
-            "expires_at": expiration.isoformat()
+            # Formatted only here, for display to the user
+            "expires_at": datetime.fromtimestamp(time.time() + CHALLENGE_TTL_SECONDS).isoformat()
         }
     
     def verify_response(self, user_id: str, challenge: Dict[str, Any], response: str) -> bool:
@@ -385,28 +571,22 @@ class EmailMethod(MFAMethod):
         Returns:
             True if the response is valid, False otherwise.
         """
-        # Check if we have a code for this user
-        if user_id not in self.code_storage:
-            logger.error(f"No MFA code found for user '{user_id}'")
-            return False
-        
-        code_data = self.code_storage[user_id]
-        
-        # Check if code has expired
-        if datetime.now() > code_data["expires_at"]:
-            del self.code_storage[user_id]
-            logger.error(f"MFA code for user '{user_id}' has expired")
+        # Check if we have an unexpired code for this user
+        code = self.code_storage.get(user_id)
+        if code is None:
+            logger.error(f"No MFA code found for user '{user_id}' (never issued or expired)")
             return False
         
         # Clean up response
         response = response.strip().replace(" ", "")
         
-        # Verify code
-        if response != code_data["code"]:
+        # Verify code in constant time; compare bytes since compare_digest
+        # rejects non-ASCII str input
+        if not hmac.compare_digest(response.encode("utf-8"), code.encode("utf-8")):
             return False
         
         # Clean up code
-        del self.code_storage[user_id]
+        self.code_storage.pop(user_id)
         
         return True
     
@@ -418,7 +598,12 @@ class EmailMethod(MFAMethod):
             The generated code.
         """
         # Generate 6-digit code
-        return str(secrets.randbelow(1000000)).zfill(6)
+        if self.strict_uniform:
+            return str(secrets.randbelow(1000000)).zfill(6)
+        
+        # One 3-byte read, no rejection loop; the modulo bias over 2**24 is
+        # negligible for a short-lived single-use code
+        return f"{int.from_bytes(secrets.token_bytes(3), 'big') % 1000000:06d}"
     
     def _mask_email(self, email: str) -> str:
         """
@@ -436,17 +621,23 @@ class EmailMethod(MFAMethod):
         username, domain = email.split("@", 1)
         
         if len(username) <= 2:
-            masked_username = username[0] + "*"
-        else:
-            masked_username = username[0] + "*" * (len(username) - 2) + username[-1]
+            return f"{username[0]}*@{domain}"
+        
+        star_count = len(username) - 2
+        stars = self._STARS[star_count] if star_count < len(self._STARS) else "*" * star_count
         
-        return f"{masked_username}@{domain}"
+        return f"{username[0]}{stars}{username[-1]}@{domain}"
 
 class MFAManager:
     """
     Manager for multi-factor authentication.
     """
     
+    __slots__ = (
+        "user_storage", "session_storage", "methods", "_method_names",
+        "challenge_storage"
+    )
+    
     def __init__(self, user_storage: UserStorage, session_storage: SessionStorage):
         """
         Initialize the MFA manager.
@@ -458,9 +649,10 @@ class MFAManager:
         self.user_storage = user_storage
         self.session_storage = session_storage
         self.methods = {}  # method_id -> MFAMethod
+        self._method_names: Dict[str, str] = {}  # method_id -> name
         
         # Challenge storage
-        self.challenge_storage = {}  # user_id -> {"method_id": str, "challenge": Dict, "expires_at": datetime}
+        self.challenge_storage = TTLCache(maxsize=MAX_PENDING_CHALLENGES, ttl=CHALLENGE_TTL_SECONDS)  # user_id -> {"method_id": str, "challenge": Dict}
     
     def register_method(self, method: MFAMethod) -> None:
         """
@@ -470,6 +662,7 @@ class MFAManager:
             method: The MFA method to register.
         """
         self.methods[method.method_id] = method
+        self._method_names[method.method_id] = method.name
     
     def get_available_methods(self, user_id: str) -> List[Dict[str, Any]]:
         """
@@ -494,17 +687,17 @@ class MFAManager:
         # Get MFA data
         mfa_data = user.get("mfa", {})
         
-        # Build list of available methods
-        available_methods = []
-        
-        for method_id, method in self.methods.items():
-            if method_id in mfa_data and mfa_data[method_id].get("verified", False):
-                available_methods.append({
-                    "method_id": method_id,
-                    "name": method.name
-                })
+        # Build list of available methods, in registration order
+        verified_ids = {
+            method_id for method_id, method_data in mfa_data.items()
+            if isinstance(method_data, dict) and method_data.get("verified", False)
+        }
         
-        return available_methods
+        return [
+            {"method_id": method_id, "name": name}
+            for method_id, name in self._method_names.items()
+            if method_id in verified_ids
+        ]
     
     def generate_challenge(self, user_id: str, method_id: str) -> Dict[str, Any]:
         """
@@ -530,12 +723,10 @@ class MFAManager:
         if not challenge:
             return {}
         
-        # Store challenge with expiration
-        expiration = datetime.now() + timedelta(minutes=10)
+        # Store challenge; the cache expires it
         self.challenge_storage[user_id] = {
             "method_id": method_id,
-            "challenge": challenge,
-            "expires_at": expiration
+            "challenge": challenge
         }
         
         return challenge
@@ -551,17 +742,10 @@ class MFAManager:
         Returns:
             True if the response is valid, False otherwise.
         """
-        # Check if we have a challenge for this user
-        if user_id not in self.challenge_storage:
-            logger.error(f"No MFA challenge found for user '{user_id}'")
-            return False
-        
-        challenge_data = self.challenge_storage[user_id]
-        
-        # Check if challenge has expired
-        if datetime.now() > challenge_data["expires_at"]:
-            del self.challenge_storage[user_id]
-            logger.error(f"MFA challenge for user '{user_id}' has expired")
+        # Check if we have an unexpired challenge for this user
+        challenge_data = self.challenge_storage.get(user_id)
+        if challenge_data is None:
+            logger.error(f"No MFA challenge found for user '{user_id}' (never issued or expired)")
             return False
         
         method_id = challenge_data["method_id"]
@@ -579,7 +763,7 @@ class MFAManager:
             return False
         
         # Clean up challenge
-        del self.challenge_storage[user_id]
+        self.challenge_storage.pop(user_id)
         
         # Mark session as MFA verified
         self._mark_session_mfa_verified(user_id)
@@ -596,7 +780,12 @@ class MFAManager:
         # Find active sessions for user
         sessions = self.session_storage.find_by_user_id(user_id)
         
-        for session in sessions:
-            if session.get("is_active", False):
-                session["mfa_verified"] = True
-                self.session_storage.update(session["id"], session) 
\ No newline at end of file
+        # Write only the changed field, in one batch
+        changes_by_id = {
+            session["id"]: {"mfa_verified": True}
+            for session in sessions
+            if session.get("is_active", False) and not session.get("mfa_verified", False)
+        }
+        
+        if changes_by_id:
+            self.session_storage.update_many(changes_by_id) 
\ No newline at end of file
@@ -4,25 +4,136 @@ OAuth 2.0 authentication provider for the AI-powered data retrieval application.
 
 import logging
 import time
-from typing import Dict, List, Any, Optional, Union, Tuple
+from typing import Callable, Dict, List, Any, NamedTuple, Optional, Union, Tuple
 from datetime import datetime, timedelta
 import json
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
 import secrets
 import hashlib
+import random
+import threading
 from urllib.parse import urlencode
 
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import jwt
+    JWT_AVAILABLE = True
+except ImportError:
+    JWT_AVAILABLE = False
+
 from .core import (
     AuthProvider, AuthResult, AuthStatus, UserSession, UserCredentials,
-    TokenGenerator
+    TokenGenerator, get_record_timestamp
 )
-from .storage import UserStorage, SessionStorage
+from .cache import TTLCache
+from .storage import UserStorage, SessionStorage, StateStore, MemoryStateStore
 
 logger = logging.getLogger(__name__)
 
+def _make_userinfo_extractor(user_id_field: str, email_field: str,
+                             name_field: str) -> Callable[[Dict[str, Any]], Tuple[Any, Any, Any]]:
+    """
+    Build a function reading the user ID, email and name from user info.
+    
+    Args:
+        user_id_field: The user ID field.
+        email_field: The email field.
+        name_field: The name field.
+        
+    Returns:
+        A function taking user info and returning (user_id, email, name).
+    """
+    def extract(userinfo: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+        get = userinfo.get
+        return get(user_id_field), get(email_field), get(name_field)
+    
+    return extract
+
+def _parse_json_response(body: bytes) -> Any:
+    """Decode a provider's JSON response body, using orjson when available."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(body)
+    return json.loads(body)
+
+# Validated sessions kept in memory. Entries are re-read from storage after
+# the TTL so sessions revoked by another process don't stay valid for long.
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL_SECONDS = 30
+
+# Userinfo fields stored with a new user, by provider; other providers keep all fields
+_USERINFO_KEEP = {
+    "google": frozenset({"sub", "email", "email_verified", "name", "picture"}),
+    "microsoft": frozenset({"sub", "email", "name", "preferred_username"}),
+    "apple": frozenset({"sub", "email", "email_verified", "name"}),
+    "github": frozenset({"id", "login", "email", "name", "avatar_url"}),
+    "facebook": frozenset({"id", "email", "name", "picture"})
+}
+
+# User fields that update_user never changes
+_IMMUTABLE_USER_FIELDS = frozenset({"id", "created_at", "credentials"})
+
+# Maximum number of (provider_id, provider_user_id) -> user_id mappings kept in memory
+OAUTH_INDEX_SIZE = 10000
+
+# User info fetched for presented access tokens, keyed by token hash. Entries
+# never outlive the token's own "exp" claim when it is a JWT.
+USERINFO_CACHE_SIZE = 10000
+USERINFO_CACHE_TTL_SECONDS = 300
+
+# Authorization states expire after this many seconds
+STATE_TTL_SECONDS = 600
+
+# Maximum number of outstanding authorization states
+MAX_PENDING_STATES = 10000
+
+# Userinfo field holding the provider's user ID, for providers that don't use "id"
+_USER_ID_FIELDS = {
+    "google": "sub",
+    "microsoft": "sub",
+    "apple": "sub"
+}
+
+# Seconds between background sweeps of expired states and JWKS refresh checks
+STATE_SWEEP_INTERVAL_SECONDS = 60
+
+# JWKS keys are revalidated in the background about this often (jittered so
+# workers don't refresh in lockstep), and not used past the TTL if that fails
+JWKS_REFRESH_SECONDS = 600
+JWKS_TTL_SECONDS = 3600
+
+# Minimum seconds between refetches triggered by an unknown key ID
+JWKS_MIN_REFETCH_SECONDS = 60
+
+class _JWKSEntry(NamedTuple):
+    """Cached signing keys of a provider."""
+    fetched_at: float
+    refresh_at: float
+    expires_at: float
+    keys: Dict[str, Any]
+    etag: Optional[str]
+
 class OAuthProvider:
     """
     Configuration for an OAuth provider.
@@ -38,7 +149,9 @@ class OAuthProvider:
                 userinfo_url: str,
                 scope: str,
                 redirect_uri: str,
-                additional_params: Optional[Dict[str, Any]] = None):
+                additional_params: Optional[Dict[str, Any]] = None,
+                jwks_uri: Optional[str] = None,
+                issuer: Optional[str] = None):
         """
         Initialize the OAuth provider configuration.
         
@@ -53,6 +166,10 @@ class OAuthProvider:
             scope: The OAuth scope.
             redirect_uri: The redirect URI.
             additional_params: Additional parameters for the OAuth flow.
+            jwks_uri: The provider's JWKS URL. When set together with the issuer
+                and PyJWT is installed, JWT access tokens are verified locally
+                instead of calling the user info URL.
+            issuer: The expected "iss" claim of the provider's access tokens.
         """
         self.provider_id = provider_id
         self.name = name
@@ -64,6 +181,44 @@ class OAuthProvider:
         self.scope = scope
         self.redirect_uri = redirect_uri
         self.additional_params = additional_params or {}
+        self.jwks_uri = jwks_uri
+        self.issuer = issuer
+        
+        # Userinfo fields; all supported providers use the standard names
+        # for email and name
+        self.user_id_field = _USER_ID_FIELDS.get(provider_id, "id")
+        self.email_field = "email"
+        self.name_field = "name"
+        self.extract = _make_userinfo_extractor(self.user_id_field, self.email_field, self.name_field)
+        self.userinfo_fields = _USERINFO_KEEP.get(provider_id)
+        
+        # Authorization URL parameters that don't change between requests
+        static_params = {
+            "client_id": client_id,
+            "response_type": "code",
+            "scope": scope,
+            "code_challenge_method": "S256"
+        }
+        static_params.update(self.additional_params)
+        self._authorize_prefix = f"{authorize_url}?{urlencode(static_params, doseq=True)}"
+        self._redirect_query = urlencode({"redirect_uri": redirect_uri})
+    
+    def get_authorization_url(self, state: str, code_challenge: str, redirect_uri: Optional[str] = None) -> str:
+        """
+        Build the authorization URL for a login.
+        
+        Args:
+            state: The state parameter.
+            code_challenge: The PKCE code challenge.
+            redirect_uri: Optional override for the redirect URI.
+            
+        Returns:
+            The authorization URL.
+        """
+        redirect_query = urlencode({"redirect_uri": redirect_uri}) if redirect_uri else self._redirect_query
+        
+        # State and challenge are URL-safe base64 and need no escaping
+        return f"{self._authorize_prefix}&{redirect_query}&state={state}&code_challenge={code_challenge}"
 
 class OAuthAuthProvider(AuthProvider):
     """
@@ -74,7 +229,9 @@ class OAuthAuthProvider(AuthProvider):
                 user_storage: UserStorage,
                 session_storage: SessionStorage,
                 oauth_providers: List[OAuthProvider],
-                session_duration_minutes: int = 60):
+                session_duration_minutes: int = 60,
+                activity_write_interval: int = 60,
+                state_store: Optional[StateStore] = None):
         """
         Initialize the OAuth authentication provider.
         
@@ -83,14 +240,52 @@ class OAuthAuthProvider(AuthProvider):
             session_storage: The session storage.
             oauth_providers: The OAuth providers.
             session_duration_minutes: The session duration in minutes.
+            activity_write_interval: Minimum number of seconds between persisted last_activity updates.
+            state_store: Where authorization state is kept between the redirect and
+                the callback. Defaults to an in-process store; multi-worker
+                deployments should share a Redis or Memcached store.
         """
         self.user_storage = user_storage
         self.session_storage = session_storage
         self.oauth_providers = {provider.provider_id: provider for provider in oauth_providers}
         self.session_duration_minutes = session_duration_minutes
-        
-        # State and PKCE storage
-        self.state_storage = {}  # state -> {"provider_id": str, "created_at": datetime, "redirect_uri": str, "code_verifier": str}
+        self.activity_write_interval = activity_write_interval
+        
+        # Validated sessions: session_id -> (expires_at_ts, user_id, last_activity_ts)
+        self._session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS)
+        
+        # Known OAuth identities: (provider_id, provider_user_id) -> user_id
+        self._oauth_index = TTLCache(maxsize=OAUTH_INDEX_SIZE)
+        
+        # User info by (provider_id, sha256(access_token)), and the events of
+        # fetches in progress so concurrent requests for a token share one call
+        self._userinfo_cache = TTLCache(maxsize=USERINFO_CACHE_SIZE, ttl=USERINFO_CACHE_TTL_SECONDS)
+        self._userinfo_inflight: Dict[Tuple[str, bytes], threading.Event] = {}
+        self._userinfo_lock = threading.Lock()
+        
+        # State and PKCE storage: state -> {"provider_id": str, "redirect_uri": str, "code_verifier": str}
+        self.state_store = state_store or MemoryStateStore(max_entries=MAX_PENDING_STATES)
+        
+        # Pooled HTTP client, so token and userinfo calls reuse keep-alive
+        # connections to the provider instead of a new TLS handshake each.
+        # Retry only covers idempotent methods; a token POST is never resent
+        # because authorization codes are single-use.
+        retry = Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504])
+        self._http = requests.Session()
+        self._http.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=retry))
+        
+        # Async client for handle_callback_async, created on first use
+        self._ahttp = None
+        
+        # Signing keys for local JWT verification: provider_id -> _JWKSEntry
+        self._jwks_cache: Dict[str, _JWKSEntry] = {}
+        self._jwks_lock = threading.Lock()
+        
+        # Background sweeper for expired states and JWKS refresh
+        self.stop_event = threading.Event()
+        self.sweeper_thread = threading.Thread(target=self._sweep_states)
+        self.sweeper_thread.daemon = True
+        self.sweeper_thread.start()
     
     def authenticate(self, credentials: Dict[str, Any]) -> AuthResult:
         """
@@ -125,8 +320,10 @@ class OAuthAuthProvider(AuthProvider):
             )
         
         try:
-            # Get user info
-            userinfo = self._get_userinfo(provider, access_token)
+            # Get user info, from the token itself when it is a verifiable JWT
+            userinfo = self._decode_access_token(provider, access_token)
+            if userinfo is None:
+                userinfo = self._get_userinfo_cached(provider, access_token)
             
             if not userinfo:
                 return AuthResult(
@@ -134,18 +331,17 @@ class OAuthAuthProvider(AuthProvider):
                     message="Failed to get user info"
                 )
             
-            # Get user ID from provider-specific field
-            user_id_field = self._get_user_id_field(provider_id)
-            provider_user_id = userinfo.get(user_id_field)
+            # Get user ID, email and name from provider-specific fields
+            provider_user_id, email, name = provider.extract(userinfo)
             
             if not provider_user_id:
                 return AuthResult(
                     status=AuthStatus.FAILURE,
-                    message=f"User info does not contain {user_id_field}"
+                    message=f"User info does not contain {provider.user_id_field}"
                 )
             
             # Find or create user
-            user = self._find_or_create_user(provider_id, provider_user_id, userinfo)
+            user = self._find_or_create_user(provider_id, provider_user_id, email, name, userinfo)
             
             if not user:
                 return AuthResult(
@@ -157,20 +353,7 @@ class OAuthAuthProvider(AuthProvider):
             session = self._create_session(user["id"], ip_address, user_agent)
             
             # Store session
-            session_dict = {
-                "session_id": session.session_id,
-                "user_id": session.user_id,
-                "created_at": session.created_at.isoformat(),
-                "expires_at": session.expires_at.isoformat(),
-                "ip_address": session.ip_address,
-                "user_agent": session.user_agent,
-                "is_active": session.is_active,
-                "last_activity": session.last_activity.isoformat() if session.last_activity else None,
-                "mfa_verified": session.mfa_verified,
-                "metadata": session.metadata
-            }
-            
-            if not self.session_storage.create(session_dict):
+            if not self.session_storage.create(session.to_storage_dict()):
                 return AuthResult(
                     status=AuthStatus.FAILURE,
                     message="Failed to create session"
@@ -201,31 +384,39 @@ class OAuthAuthProvider(AuthProvider):
         Returns:
             True if the session is valid, False otherwise.
         """
-        session = self.session_storage.get(session_id)
-        
-        if not session:
-            return False
+        cached = self._session_cache.get(session_id)
+        if cached is None:
+            session = self.session_storage.get(session_id)
+            
+            if not session:
+                return False
+            
+            # Check if session is active
+            if not session.get("is_active", False):
+                return False
+            
+            # Sessions store epoch timestamps; rows written before that are
+            # parsed once here and cache hits compare the epoch value
+            expiration = get_record_timestamp(session, "expires_at")
+            if expiration is None:
+                return False
+            
+            last_activity = get_record_timestamp(session, "last_activity") or 0
+            cached = (expiration, session.get("user_id"), last_activity)
+            self._session_cache[session_id] = cached
         
-        # Check if session is active
-        if not session.get("is_active", False):
-            return False
+        expiration, user_id, last_activity = cached
         
         # Check if session has expired
-        expires_at = session.get("expires_at")
-        if not expires_at:
-            return False
-        
-        try:
-            expiration = datetime.fromisoformat(expires_at)
-            if datetime.now() > expiration:
-                return False
-        except Exception as e:
-            logger.error(f"Error parsing expiration date: {e}")
+        now = time.time()
+        if now > expiration:
+            self._session_cache.pop(session_id)
             return False
         
-        # Update last activity
-        session["last_activity"] = datetime.now().isoformat()
-        self.session_storage.update(session_id, session)
+        # Update last activity, persisting at most once per write interval
+        if now - last_activity >= self.activity_write_interval:
+            self.session_storage.update_many({session_id: {"last_activity_ts": now}})
+            self._session_cache[session_id] = (expiration, user_id, now)
         
         return True
     
@@ -246,6 +437,7 @@ class OAuthAuthProvider(AuthProvider):
         
         # Mark session as inactive
         session["is_active"] = False
+        self._session_cache.pop(session_id)
         
         return self.session_storage.update(session_id, session)
     
@@ -279,9 +471,7 @@ class OAuthAuthProvider(AuthProvider):
             return False
         
         # Update user data
-        for key, value in user_data.items():
-            if key not in ["id", "created_at", "credentials"]:
-                user[key] = value
+        user.update({key: value for key, value in user_data.items() if key not in _IMMUTABLE_USER_FIELDS})
         
         return self.user_storage.update(user_id, user)
     
@@ -295,6 +485,8 @@ class OAuthAuthProvider(AuthProvider):
         Returns:
             True if the deletion was successful, False otherwise.
         """
+        self._oauth_index.evict(lambda _, indexed_user_id: indexed_user_id == user_id)
+        
         return self.user_storage.delete(user_id)
     
     def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
@@ -382,33 +574,25 @@ class OAuthAuthProvider(AuthProvider):
         # Generate state
         state = secrets.token_urlsafe(32)
         
-        # Generate PKCE code verifier and challenge
-        code_verifier = secrets.token_urlsafe(64)
-        code_challenge = self._generate_code_challenge(code_verifier)
+        # Generate PKCE code verifier and challenge. 48 random bytes encode to
+        # exactly 64 base64 characters with no padding, and the challenge is
+        # hashed from those bytes without a str round trip.
+        code_verifier_bytes = base64.urlsafe_b64encode(secrets.token_bytes(48))
+        code_challenge = self._generate_code_challenge(code_verifier_bytes)
+        code_verifier = code_verifier_bytes.decode("ascii")
         
         # Store state
-        self.state_storage[state] = {
+        state_data = {
             "provider_id": provider_id,
-            "created_at": datetime.now(),
             "redirect_uri": redirect_uri or provider.redirect_uri,
             "code_verifier": code_verifier
         }
         
-        # Build authorization URL
-        params = {
-            "client_id": provider.client_id,
-            "redirect_uri": redirect_uri or provider.redirect_uri,
-            "response_type": "code",
-            "scope": provider.scope,
-            "state": state,
-            "code_challenge": code_challenge,
-            "code_challenge_method": "S256"
-        }
-        
-        # Add additional params
-        params.update(provider.additional_params)
+        if not self.state_store.put(state, state_data, STATE_TTL_SECONDS):
+            raise RuntimeError("Failed to store OAuth state")
         
-        authorization_url = f"{provider.authorize_url}?{urlencode(params)}"
+        # Build authorization URL
+        authorization_url = provider.get_authorization_url(state, code_challenge, redirect_uri)
         
         return authorization_url, state
     
@@ -425,37 +609,11 @@ class OAuthAuthProvider(AuthProvider):
         Returns:
             The result of the authentication attempt.
         """
-        # Validate state
-        if state not in self.state_storage:
-            return AuthResult(
-                status=AuthStatus.FAILURE,
-                message="Invalid state parameter"
-            )
-        
-        state_data = self.state_storage[state]
-        
-        # Check if state has expired (10 minutes)
-        if datetime.now() - state_data["created_at"] > timedelta(minutes=10):
-            del self.state_storage[state]
-            return AuthResult(
-                status=AuthStatus.FAILURE,
-                message="State parameter has expired"
-            )
-        
-        # Check if provider matches
-        if state_data["provider_id"] != provider_id:
-            return AuthResult(
-                status=AuthStatus.FAILURE,
-                message="Provider mismatch"
-            )
+        checked = self._check_callback_state(provider_id, state)
+        if isinstance(checked, AuthResult):
+            return checked
         
-        # Get provider
-        provider = self.oauth_providers.get(provider_id)
-        if not provider:
-            return AuthResult(
-                status=AuthStatus.FAILURE,
-                message=f"Unknown OAuth provider: {provider_id}"
-            )
+        provider, state_data = checked
         
         try:
             # Exchange code for tokens
@@ -475,71 +633,192 @@ class OAuthAuthProvider(AuthProvider):
             # Get user info
             userinfo = self._get_userinfo(provider, token_data["access_token"])
             
-            if not userinfo:
-                return AuthResult(
-                    status=AuthStatus.FAILURE,
-                    message="Failed to get user info"
-                )
+            return self._complete_callback(provider_id, token_data, userinfo)
             
-            # Get user ID from provider-specific field
-            user_id_field = self._get_user_id_field(provider_id)
-            provider_user_id = userinfo.get(user_id_field)
+        except Exception as e:
+            logger.error(f"Error handling OAuth callback: {e}")
             
-            if not provider_user_id:
-                return AuthResult(
-                    status=AuthStatus.FAILURE,
-                    message=f"User info does not contain {user_id_field}"
-                )
+            return AuthResult(
+                status=AuthStatus.FAILURE,
+                message=f"Callback error: {str(e)}"
+            )
+    
+    async def handle_callback_async(self, provider_id: str, code: str, state: str,
+                                    redirect_uri: Optional[str] = None) -> AuthResult:
+        """
+        Handle an OAuth callback without blocking the event loop on provider calls.
+        
+        Requires httpx. The async client is created on first use and must be
+        used from a single event loop; call aclose() from that loop when done.
+        
+        Args:
+            provider_id: The provider ID.
+            code: The authorization code.
+            state: The state parameter.
+            redirect_uri: Optional override for the redirect URI.
             
-            # Find or create user
-            user = self._find_or_create_user(provider_id, provider_user_id, userinfo, token_data)
+        Returns:
+            The result of the authentication attempt.
+        """
+        if not HTTPX_AVAILABLE:
+            raise RuntimeError("httpx is required for async OAuth callbacks")
+        
+        checked = self._check_callback_state(provider_id, state)
+        if isinstance(checked, AuthResult):
+            return checked
+        
+        provider, state_data = checked
+        
+        try:
+            # Exchange code for tokens
+            token_data = await self._exchange_code_async(
+                provider,
+                code,
+                redirect_uri or state_data["redirect_uri"],
+                state_data["code_verifier"]
+            )
             
-            if not user:
+            if not token_data or "access_token" not in token_data:
                 return AuthResult(
                     status=AuthStatus.FAILURE,
-                    message="Failed to find or create user"
+                    message="Failed to exchange code for tokens"
                 )
             
-            # Create session
-            session = self._create_session(user["id"], None, None)
+            # Get user info
+            userinfo = await self._get_userinfo_async(provider, token_data["access_token"])
             
-            # Store session
-            session_dict = {
-                "session_id": session.session_id,
-                "user_id": session.user_id,
-                "created_at": session.created_at.isoformat(),
-                "expires_at": session.expires_at.isoformat(),
-                "ip_address": session.ip_address,
-                "user_agent": session.user_agent,
-                "is_active": session.is_active,
-                "last_activity": session.last_activity.isoformat() if session.last_activity else None,
-                "mfa_verified": session.mfa_verified,
-                "metadata": session.metadata
-            }
-            
-            if not self.session_storage.create(session_dict):
-                return AuthResult(
-                    status=AuthStatus.FAILURE,
-                    message="Failed to create session"
-                )
+            return self._complete_callback(provider_id, token_data, userinfo)
             
-            # Clean up state
-            del self.state_storage[state]
+        except Exception as e:
+            logger.error(f"Error handling OAuth callback: {e}")
             
             return AuthResult(
-                status=AuthStatus.SUCCESS,
-                user_id=user["id"],
-                session=session,
-                message="Authentication successful"
+                status=AuthStatus.FAILURE,
+                message=f"Callback error: {str(e)}"
             )
+    
+    def _check_callback_state(self, provider_id: str, state: str) -> Union[AuthResult, Tuple[OAuthProvider, Dict[str, Any]]]:
+        """
+        Look up and check the state of an OAuth callback.
+        
+        Args:
+            provider_id: The provider ID.
+            state: The state parameter.
             
-        except Exception as e:
-            logger.error(f"Error handling OAuth callback: {e}")
+        Returns:
+            A tuple of (provider, state_data), or a failed result. The state
+            is consumed either way.
+        """
+        # Claim the state atomically, so concurrent callbacks with the same
+        # state can't both proceed; expired states are never returned
+        state_data = self.state_store.pop(state)
+        
+        if state_data is None:
+            return AuthResult(
+                status=AuthStatus.FAILURE,
+                message="Invalid or expired state parameter"
+            )
+        
+        # Check if provider matches
+        if state_data["provider_id"] != provider_id:
+            return AuthResult(
+                status=AuthStatus.FAILURE,
+                message="Provider mismatch"
+            )
+        
+        # Get provider
+        provider = self.oauth_providers.get(provider_id)
+        if not provider:
+            return AuthResult(
+                status=AuthStatus.FAILURE,
+                message=f"Unknown OAuth provider: {provider_id}"
+            )
+        
+        return provider, state_data
+    
+    def _complete_callback(self, provider_id: str, token_data: Dict[str, Any],
+                           userinfo: Dict[str, Any]) -> AuthResult:
+        """
+        Sign in the user of an OAuth callback once the provider calls are done.
+        
+        Args:
+            provider_id: The provider ID.
+            token_data: The token data.
+            userinfo: The user info.
             
+        Returns:
+            The result of the authentication attempt.
+        """
+        if not userinfo:
             return AuthResult(
                 status=AuthStatus.FAILURE,
-                message=f"Callback error: {str(e)}"
+                message="Failed to get user info"
+            )
+        
+        # Get user ID, email and name from provider-specific fields
+        provider = self.oauth_providers[provider_id]
+        provider_user_id, email, name = provider.extract(userinfo)
+        
+        if not provider_user_id:
+            return AuthResult(
+                status=AuthStatus.FAILURE,
+                message=f"User info does not contain {provider.user_id_field}"
+            )
+        
+        # Find or create user
+        user = self._find_or_create_user(provider_id, provider_user_id, email, name, userinfo, token_data)
+        
+        if not user:
+            return AuthResult(
+                status=AuthStatus.FAILURE,
+                message="Failed to find or create user"
             )
+        
+        # Create session
+        session = self._create_session(user["id"], None, None)
+        
+        # Store session
+        if not self.session_storage.create(session.to_storage_dict()):
+            return AuthResult(
+                status=AuthStatus.FAILURE,
+                message="Failed to create session"
+            )
+        
+        return AuthResult(
+            status=AuthStatus.SUCCESS,
+            user_id=user["id"],
+            session=session,
+            message="Authentication successful"
+        )
+    
+    def _sweep_states(self) -> None:
+        """
+        Worker thread that periodically drops expired authorization states
+        and revalidates signing keys that are due.
+        """
+        while not self.stop_event.wait(STATE_SWEEP_INTERVAL_SECONDS):
+            # Keep the thread alive; a failed sweep is retried on the next interval
+            try:
+                purged = self.state_store.purge_expired()
+                
+                if purged:
+                    logger.debug(f"Dropped {purged} expired OAuth states")
+                
+                now = time.monotonic()
+                for provider_id, entry in list(self._jwks_cache.items()):
+                    provider = self.oauth_providers.get(provider_id)
+                    if provider and now >= entry.refresh_at:
+                        self._fetch_jwks(provider, entry)
+            except Exception as e:
+                logger.error(f"Error sweeping OAuth state: {e}")
+    
+    def shutdown(self) -> None:
+        """
+        Shut down the OAuth authentication provider.
+        """
+        self.stop_event.set()
+        self.sweeper_thread.join(timeout=5.0)
+        self._http.close()
     
     def _exchange_code(self, provider: OAuthProvider, code: str, redirect_uri: str, code_verifier: str) -> Dict[str, Any]:
         """
@@ -563,13 +842,13 @@ class OAuthAuthProvider(AuthProvider):
             "code_verifier": code_verifier
         }
         
-        response = requests.post(provider.token_url, data=params, timeout=10)
+        response = self._http.post(provider.token_url, data=params, timeout=10)
         
         if response.status_code != 200:
             logger.error(f"Error exchanging code: {response.text}")
             return {}
         
-        return response.json()
+        return _parse_json_response(response.content)
     
     def _get_userinfo(self, provider: OAuthProvider, access_token: str) -> Dict[str, Any]:
         """
@@ -586,54 +865,355 @@ class OAuthAuthProvider(AuthProvider):
             "Authorization": f"Bearer {access_token}"
         }
         
-        response = requests.get(provider.userinfo_url, headers=headers, timeout=10)
+        response = self._http.get(provider.userinfo_url, headers=headers, timeout=10)
         
         if response.status_code != 200:
             logger.error(f"Error getting user info: {response.text}")
             return {}
         
-        return response.json()
+        return _parse_json_response(response.content)
+    
+    def _get_userinfo_cached(self, provider: OAuthProvider, access_token: str) -> Dict[str, Any]:
+        """
+        Get user info for a presented access token, sharing results between requests.
+        
+        Concurrent requests with the same token wait for a single provider
+        call instead of each making their own.
+        
+        Args:
+            provider: The OAuth provider.
+            access_token: The access token.
+            
+        Returns:
+            The user info.
+        """
+        key = (provider.provider_id, hashlib.sha256(access_token.encode()).digest())
+        
+        userinfo = self._userinfo_cache.get(key)
+        if userinfo is not None:
+            return userinfo
+        
+        with self._userinfo_lock:
+            event = self._userinfo_inflight.get(key)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._userinfo_inflight[key] = event
+        
+        if not leader:
+            # Another request is fetching this token; use its result if it got one
+            event.wait(timeout=10)
+            userinfo = self._userinfo_cache.get(key)
+            if userinfo is not None:
+                return userinfo
+            
+            return self._get_userinfo(provider, access_token)
+        
+        try:
+            userinfo = self._get_userinfo(provider, access_token)
+            
+            if userinfo:
+                ttl = USERINFO_CACHE_TTL_SECONDS
+                expires_at = self._get_token_expiry(access_token)
+                if expires_at is not None:
+                    ttl = min(ttl, expires_at - time.time())
+                
+                if ttl > 0:
+                    self._userinfo_cache.set(key, userinfo, ttl=ttl)
+            
+            return userinfo
+        finally:
+            with self._userinfo_lock:
+                self._userinfo_inflight.pop(key, None)
+            event.set()
+    
+    def _decode_access_token(self, provider: OAuthProvider, access_token: str) -> Optional[Dict[str, Any]]:
+        """
+        Verify a JWT access token locally and return its claims.
+        
+        Args:
+            provider: The OAuth provider.
+            access_token: The access token.
+            
+        Returns:
+            The token claims, or None if the token can't be verified locally
+            and the user info URL has to be used instead.
+        """
+        if not JWT_AVAILABLE or not provider.jwks_uri or not provider.issuer or access_token.count(".") != 2:
+            return None
+        
+        try:
+            key = self._get_signing_key(provider, jwt.get_unverified_header(access_token).get("kid"))
+            if key is None:
+                return None
+            
+            return jwt.decode(
+                access_token,
+                key,
+                algorithms=["RS256"],
+                audience=provider.client_id,
+                issuer=provider.issuer,
+                options={"require": ["exp", "sub"]}
+            )
+        except Exception as e:
+            logger.debug(f"Falling back to user info for {provider.provider_id} token: {e}")
+            return None
+    
+    def _get_signing_key(self, provider: OAuthProvider, kid: Optional[str]) -> Any:
+        """
+        Get a provider's signing key from the JWKS cache, fetching on a miss.
+        
+        Args:
+            provider: The OAuth provider.
+            kid: The key ID from the token header.
+            
+        Returns:
+            The key, or None if it isn't known.
+        """
+        now = time.monotonic()
+        entry = self._jwks_cache.get(provider.provider_id)
+        
+        if entry is None or now >= entry.expires_at:
+            entry = self._fetch_jwks(provider, entry)
+        elif kid not in entry.keys and now - entry.fetched_at >= JWKS_MIN_REFETCH_SECONDS:
+            # The provider may have rotated keys since the last fetch
+            entry = self._fetch_jwks(provider, entry)
+        
+        if entry is None or now >= entry.expires_at:
+            return None
+        
+        return entry.keys.get(kid)
+    
+    def _fetch_jwks(self, provider: OAuthProvider, entry: Optional[_JWKSEntry]) -> Optional[_JWKSEntry]:
+        """
+        Fetch or revalidate a provider's signing keys.
+        
+        Sends the cached ETag, so an unchanged key set costs a 304 response.
+        
+        Args:
+            provider: The OAuth provider.
+            entry: The current cache entry, if any.
+            
+        Returns:
+            The new cache entry, or the current one if the fetch failed.
+        """
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        
+        try:
+            response = self._http.get(provider.jwks_uri, headers=headers, timeout=10)
+            body = _parse_json_response(response.content) if response.status_code == 200 else None
+        except Exception as e:
+            logger.error(f"Error fetching JWKS for {provider.provider_id}: {e}")
+            return entry
+        
+        if response.status_code == 304 and entry is not None:
+            keys, etag = entry.keys, entry.etag
+        elif response.status_code == 200:
+            jwks = body.get("keys") if isinstance(body, dict) else None
+            if not isinstance(jwks, list):
+                logger.error(f"Error fetching JWKS for {provider.provider_id}: invalid key set")
+                return entry
+            
+            keys = {}
+            for jwk in jwks:
+                if not isinstance(jwk, dict):
+                    continue
+                
+                kid = jwk.get("kid")
+                if not kid or jwk.get("use", "sig") != "sig":
+                    continue
+                
+                try:
+                    keys[kid] = jwt.PyJWK(jwk).key
+                except Exception as e:
+                    logger.debug(f"Skipping JWKS key {kid} of {provider.provider_id}: {e}")
+            
+            etag = response.headers.get("ETag")
+        else:
+            logger.error(f"Error fetching JWKS for {provider.provider_id}: HTTP {response.status_code}")
+            return entry
+        
+        now = time.monotonic()
+        new_entry = _JWKSEntry(
+            fetched_at=now,
+            refresh_at=now + JWKS_REFRESH_SECONDS * random.uniform(0.8, 1.2),
+            expires_at=now + JWKS_TTL_SECONDS,
+            keys=keys,
+            etag=etag
+        )
+        
+        with self._jwks_lock:
+            self._jwks_cache[provider.provider_id] = new_entry
+        
+        return new_entry
+    
+    def _get_token_expiry(self, access_token: str) -> Optional[float]:
+        """
+        Read the "exp" claim of a JWT access token without verifying it.
+        
+        Only used to bound how long derived data is cached; the token itself
+        is still checked by the provider.
+        
+        Args:
+            access_token: The access token.
+            
+        Returns:
+            The expiry as seconds since the epoch, or None if the token isn't a JWT with an expiry.
+        """
+        parts = access_token.split(".")
+        if len(parts) != 3:
+            return None
+        
+        try:
+            payload = parts[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            expires_at = claims.get("exp")
+        except Exception:
+            return None
+        
+        if not isinstance(expires_at, (int, float)):
+            return None
+        
+        return float(expires_at)
     
-    def _find_or_create_user(self, provider_id: str, provider_user_id: str, 
-                           userinfo: Dict[str, Any], token_data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    def _get_async_http(self) -> "httpx.AsyncClient":
+        """
+        Get the async HTTP client, creating it on first use.
+        
+        Uses HTTP/2 when h2 is installed, so concurrent callbacks to the same
+        provider share one connection.
+        
+        Returns:
+            The async HTTP client.
+        """
+        if self._ahttp is None:
+            self._ahttp = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=10,
+                limits=httpx.Limits(max_keepalive_connections=64)
+            )
+        
+        return self._ahttp
+    
+    async def _exchange_code_async(self, provider: OAuthProvider, code: str, redirect_uri: str,
+                                   code_verifier: str) -> Dict[str, Any]:
+        """
+        Exchange an authorization code for tokens without blocking.
+        
+        Args:
+            provider: The OAuth provider.
+            code: The authorization code.
+            redirect_uri: The redirect URI.
+            code_verifier: The PKCE code verifier.
+            
+        Returns:
+            The token data.
+        """
+        params = {
+            "client_id": provider.client_id,
+            "client_secret": provider.client_secret,
+            "code": code,
+            "redirect_uri": redirect_uri,
+            "grant_type": "authorization_code",
+            "code_verifier": code_verifier
+        }
+        
+        response = await self._get_async_http().post(provider.token_url, data=params)
+        
+        if response.status_code != 200:
+            logger.error(f"Error exchanging code: {response.text}")
+            return {}
+        
+        return _parse_json_response(response.content)
+    
+    async def _get_userinfo_async(self, provider: OAuthProvider, access_token: str) -> Dict[str, Any]:
+        """
+        Get user info from an OAuth provider without blocking.
+        
+        Args:
+            provider: The OAuth provider.
+            access_token: The access token.
+            
+        Returns:
+            The user info.
+        """
+        headers = {
+            "Authorization": f"Bearer {access_token}"
+        }
+        
+        response = await self._get_async_http().get(provider.userinfo_url, headers=headers)
+        
+        if response.status_code != 200:
+            logger.error(f"Error getting user info: {response.text}")
+            return {}
+        
+        return _parse_json_response(response.content)
+    
+    async def aclose(self) -> None:
+        """
+        Close the async HTTP client.
+        """
+        if self._ahttp is not None:
+            await self._ahttp.aclose()
+            self._ahttp = None
+    
+    def _find_or_create_user(self, provider_id: str, provider_user_id: str, email: Optional[str],
+                           name: Optional[str], userinfo: Dict[str, Any],
+                           token_data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """
         Find or create a user based on OAuth user info.
         
         Args:
             provider_id: The provider ID.
             provider_user_id: The provider-specific user ID.
+            email: The email from the user info.
+            name: The name from the user info.
             userinfo: The user info from the provider.
             token_data: Optional token data.
             
         Returns:
             The user data, or None if not found or created.
         """
-        # Try to find existing user
-        users = self.user_storage.list({
-            f"oauth_providers.{provider_id}.id": provider_user_id
-        })
-        
-        if users:
-            user = users[0]
+        # Try to find existing user, skipping the storage query for known identities
+        index_key = (provider_id, provider_user_id)
+        user = None
+        
+        user_id = self._oauth_index.get(index_key)
+        if user_id is not None:
+            user = self.user_storage.get(user_id)
+            linked = user.get("oauth_providers", {}).get(provider_id, {}) if user else {}
+            if linked.get("id") != provider_user_id:
+                self._oauth_index.pop(index_key)
+                user = None
+        
+        if user is None:
+            users = self.user_storage.list({
+                f"oauth_providers.{provider_id}.id": provider_user_id
+            })
+            if users:
+                user = users[0]
+                self._oauth_index[index_key] = user["id"]
+        
+        if user:
             
-            # Update OAuth tokens if provided
+            # Update OAuth tokens if provided, writing only those fields
             if token_data:
-                if "oauth_providers" not in user:
-                    user["oauth_providers"] = {}
+                updated_at = datetime.now().isoformat()
+                self.user_storage.patch(user["id"], {
+                    f"oauth_providers.{provider_id}.tokens": token_data,
+                    f"oauth_providers.{provider_id}.updated_at": updated_at
+                })
                 
-                if provider_id not in user["oauth_providers"]:
-                    user["oauth_providers"][provider_id] = {}
-                
-                user["oauth_providers"][provider_id]["tokens"] = token_data
-                user["oauth_providers"][provider_id]["updated_at"] = datetime.now().isoformat()
-                
-                self.user_storage.update(user["id"], user)
+                provider_data = user.setdefault("oauth_providers", {}).setdefault(provider_id, {})
+                provider_data["tokens"] = token_data
+                provider_data["updated_at"] = updated_at
             
             return user
         
         # Create new user
-        email = self._get_email_from_userinfo(provider_id, userinfo)
-        name = self._get_name_from_userinfo(provider_id, userinfo)
+        provider = self.oauth_providers[provider_id]
         
         user_data = {
             "username": email or f"{provider_id}_{provider_user_id}",
@@ -642,7 +1222,7 @@ class OAuthAuthProvider(AuthProvider):
             "oauth_providers": {
                 provider_id: {
                     "id": provider_user_id,
-                    "userinfo": userinfo,
+                    "userinfo": self._filter_userinfo(provider, userinfo),
                     "tokens": token_data,
                     "created_at": datetime.now().isoformat(),
                     "updated_at": datetime.now().isoformat()
@@ -657,8 +1237,25 @@ class OAuthAuthProvider(AuthProvider):
         if not user_id:
             return None
         
+        self._oauth_index[index_key] = user_id
         return self.user_storage.get(user_id)
     
+    def _filter_userinfo(self, provider: OAuthProvider, userinfo: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Reduce user info to the fields worth storing with the user.
+        
+        Args:
+            provider: The OAuth provider.
+            userinfo: The user info from the provider.
+            
+        Returns:
+            The user info to store.
+        """
+        if provider.userinfo_fields is None:
+            return userinfo
+        
+        return {key: value for key, value in userinfo.items() if key in provider.userinfo_fields}
+    
     def _create_session(self, user_id: str, ip_address: Optional[str], user_agent: Optional[str]) -> UserSession:
         """
         Create a new user session.
@@ -689,82 +1286,22 @@ class OAuthAuthProvider(AuthProvider):
         
         return session
     
-    def _generate_code_challenge(self, code_verifier: str) -> str:
+    def _generate_code_challenge(self, code_verifier: Union[str, bytes]) -> str:
         """
         Generate a PKCE code challenge from a code verifier.
         
         Args:
-            code_verifier: The code verifier.
+            code_verifier: The code verifier, as a string or its ASCII bytes.
             
         Returns:
             The code challenge.
         """
-        code_challenge = hashlib.sha256(code_verifier.encode()).digest()
-        return base64.urlsafe_b64encode(code_challenge).decode().rstrip("=")
-    
-    def _get_user_id_field(self, provider_id: str) -> str:
-        """
-        Get the user ID field for a provider.
-        
-        Args:
-            provider_id: The provider ID.
-            
-        Returns:
-            The user ID field.
-        """
-        # Provider-specific mappings
-        mappings = {
-            "google": "sub",
-            "facebook": "id",
-            "github": "id",
-            "microsoft": "sub",
-            "apple": "sub"
-        }
-        
-        return mappings.get(provider_id, "id")
-    
-    def _get_email_from_userinfo(self, provider_id: str, userinfo: Dict[str, Any]) -> Optional[str]:
-        """
-        Get the email from user info.
-        
-        Args:
-            provider_id: The provider ID.
-            userinfo: The user info.
-            
-        Returns:
-            The email, or None if not found.
-        """
-        # Provider-specific mappings
-        mappings = {
-            "google": "email",
-            "facebook": "email",
-            "github": "email",
-            "microsoft": "email",
-            "apple": "email"
-        }
-        
-        field = mappings.get(provider_id, "email")
-        return userinfo.get(field)
-    
-    def _get_name_from_userinfo(self, provider_id: str, userinfo: Dict[str, Any]) -> Optional[str]:
-        """
-        Get the name from user info.
+        if isinstance(code_verifier, str):
+            code_verifier = code_verifier.encode("ascii")
         
-        Args:
-            provider_id: The provider ID.
-            userinfo: The user info.
-            
-        Returns:
-            The name, or None if not found.
-        """
-        # Provider-specific mappings
-        mappings = {
-            "google": "name",
-            "facebook": "name",
-            "github": "name",
-            "microsoft": "name",
-            "apple": "name"
-        }
+        digest = hashlib.sha256(code_verifier).digest()
         
-        field = mappings.get(provider_id, "name")
-        return userinfo.get(field) 
\ No newline at end of file
+        # A 32-byte digest always encodes to 43 characters plus one "=" pad
+        encoded = base64.urlsafe_b64encode(digest)
+        assert len(encoded) == 44
+        return encoded[:-1].decode("ascii")
@@ -2,22 +2,132 @@
 Password-based authentication provider for the AI-powered data retrieval application.
 """
 
+import hashlib
+import hmac
 import logging
 import time
-from typing import Dict, List, Any, Optional, Union, Tuple
+from typing import Callable, Dict, List, Any, Optional, Union, Tuple
 from datetime import datetime, timedelta
 import json
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .core import (
     AuthProvider, AuthResult, AuthStatus, UserSession, UserCredentials,
-    PasswordHasher, TokenGenerator
+    PasswordHasher, TokenGenerator, get_record_timestamp, get_request_time
 )
+from .cache import TTLCache
 from .storage import UserStorage, SessionStorage
 
 logger = logging.getLogger(__name__)
 
+# Characters accepted as "special" by the password policy
+_SPECIAL_CHARS = frozenset('!@#$%^&*(),.?":{}|<>')
+
+# Character class bits used by PasswordPolicy.validate_password
+_UPPER = 1
+_LOWER = 2
+_DIGIT = 4
+_SPECIAL = 8
+
+def _classify(char: str) -> int:
+    """
+    Get the character class bit of a character.
+    
+    Args:
+        char: The character.
+        
+    Returns:
+        The class bit, or 0 if the character belongs to no class.
+    """
+    if char.isupper():
+        return _UPPER
+    if char.islower():
+        return _LOWER
+    if char.isdigit():
+        return _DIGIT
+    if char in _SPECIAL_CHARS:
+        return _SPECIAL
+    return 0
+
+# Class bit of every ASCII character, for classifying ASCII passwords with bytes.translate
+_ASCII_CLASSES = bytes(_classify(chr(b)) if b < 128 else 0 for b in range(256))
+
+# Error messages for each character class, in reporting order
+_CLASS_ERRORS = (
+    (_UPPER, "Password must contain at least one uppercase letter"),
+    (_LOWER, "Password must contain at least one lowercase letter"),
+    (_DIGIT, "Password must contain at least one number"),
+    (_SPECIAL, "Password must contain at least one special character"),
+)
+
+# Recent validation results, keyed by the policy signature and a keyed digest
+# of the password, so bulk imports and retried forms skip revalidation. The
+# key never leaves the process.
+VALIDATION_CACHE_SIZE = 1024
+_VALIDATION_CACHE_KEY = os.urandom(32)
+_validation_cache = TTLCache(maxsize=VALIDATION_CACHE_SIZE)
+
+# Field layout of new password users. Copying a template gives a dict that is
+# already sized for every field; mutable values must be replaced, not shared.
+_CREDENTIALS_TEMPLATE = {
+    "username": None,
+    "password_hash": None,
+    "salt": None,
+    "last_password_change": None,
+    "last_password_change_ts": None,
+    "password_history": None,
+    "mfa_enabled": False,
+    "api_keys": None
+}
+_USER_TEMPLATE = {
+    "username": None,
+    "email": None,
+    "first_name": None,
+    "last_name": None,
+    "created_at": None,
+    "updated_at": None,
+    "credentials": None,
+    "roles": None,
+    "is_active": True,
+    "metadata": None
+}
+
+# Validated sessions kept in memory. Entries are re-read from storage after
+# the TTL so sessions revoked by another process don't stay valid for long.
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL_SECONDS = 5
+
+# Shared pool for checking password history entries in parallel; the KDF
+# releases the GIL, so each verification runs on its own core
+_history_executor = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1, thread_name_prefix="password-history"
+)
+
+# Recently rejected credentials, keyed by username and a keyed digest of the
+# password, so repeated bad logins are refused without running the KDF again
+FAILED_LOGIN_CACHE_SIZE = 50000
+FAILED_LOGIN_CACHE_TTL_SECONDS = 60
+_FAILED_LOGIN_CACHE_KEY = os.urandom(32)
+
+# User IDs kept in memory by username, so the login path skips the username
+# scan. The user itself is always read from storage, so credentials changed
+# by another process take effect at once.
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL_SECONDS = 30
+
+# Maximum number of usernames with tracked failed login attempts. Entries are
+# only dropped once their lockout window has passed; while the cache is full of
+# live entries, untracked usernames are treated as locked.
+FAILED_ATTEMPTS_SIZE = 100000
+
+# Size of the Bloom filter over usernames with failed attempts. It lets the
+# lockout check skip the cache for users who never failed, and is rebuilt from
+# the live entries after FAILED_ATTEMPTS_SIZE insertions so it doesn't fill up.
+FAILED_FILTER_BITS = 1 << 20
+
 class PasswordPolicy:
     """
     Password policy configuration.
@@ -32,7 +142,8 @@ class PasswordPolicy:
                 max_age_days: int = 90,
                 prevent_reuse: int = 5,
                 max_failed_attempts: int = 5,
-                lockout_duration_minutes: int = 30):
+                lockout_duration_minutes: int = 30,
+                history_pepper: Optional[str] = None):
         """
         Initialize the password policy.
         
@@ -46,6 +157,9 @@ class PasswordPolicy:
             prevent_reuse: Number of previous passwords to prevent reuse.
             max_failed_attempts: Maximum number of failed login attempts before lockout.
             lockout_duration_minutes: Duration of account lockout in minutes.
+            history_pepper: Secret used to fingerprint password history entries. Defaults to
+                the PASSWORD_HISTORY_PEPPER environment variable; without one, every
+                history entry is checked with the full KDF.
         """
         self.min_length = min_length
         self.require_uppercase = require_uppercase
@@ -56,6 +170,21 @@ class PasswordPolicy:
         self.prevent_reuse = prevent_reuse
         self.max_failed_attempts = max_failed_attempts
         self.lockout_duration_minutes = lockout_duration_minutes
+        self.history_pepper = history_pepper or os.environ.get("PASSWORD_HISTORY_PEPPER")
+        
+        # Checks for the enabled rules, rebuilt when the rules change
+        self._checks_signature = None
+        self._checks: List[Callable[[str], Optional[str]]] = []
+    
+    def _signature(self) -> Tuple[Any, ...]:
+        """
+        Get the fields that determine password validation results.
+        
+        Returns:
+            A tuple that changes whenever a validation rule changes.
+        """
+        return (self.min_length, self.require_uppercase, self.require_lowercase,
+                self.require_numbers, self.require_special_chars)
     
     def validate_password(self, password: str) -> Tuple[bool, Optional[str]]:
         """
@@ -67,29 +196,99 @@ class PasswordPolicy:
         Returns:
             A tuple of (is_valid, error_message).
         """
-        if len(password) < self.min_length:
-            return False, f"Password must be at least {self.min_length} characters long"
+        digest = hashlib.blake2b(
+            password.encode(), key=_VALIDATION_CACHE_KEY, digest_size=16
+        ).digest()
+        signature = self._signature()
+        cache_key = (signature, digest)
+        
+        result = _validation_cache.get(cache_key)
+        if result is None:
+            result = self._check_password(password, signature)
+            _validation_cache[cache_key] = result
+        
+        return result
+    
+    def _check_password(self, password: str, signature: Tuple[Any, ...]) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password against the policy rules.
         
-        if self.require_uppercase and not any(c.isupper() for c in password):
-            return False, "Password must contain at least one uppercase letter"
+        Args:
+            password: The password to check.
+            signature: The current policy signature.
+            
+        Returns:
+            A tuple of (is_valid, error_message).
+        """
+        if signature != self._checks_signature:
+            self._checks = self._compile_checks()
+            self._checks_signature = signature
         
-        if self.require_lowercase and not any(c.islower() for c in password):
-            return False, "Password must contain at least one lowercase letter"
+        for check in self._checks:
+            error_message = check(password)
+            if error_message:
+                return False, error_message
         
-        if self.require_numbers and not any(c.isdigit() for c in password):
-            return False, "Password must contain at least one number"
+        return True, None
+    
+    def _compile_checks(self) -> List[Callable[[str], Optional[str]]]:
+        """
+        Build the checks for the enabled policy rules.
         
-        if self.require_special_chars and not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
-            return False, "Password must contain at least one special character"
+        Returns:
+            Functions that return an error message for a failing password, in reporting order.
+        """
+        checks = []
         
-        return True, None
+        min_length = self.min_length
+        if min_length > 0:
+            length_error = f"Password must be at least {min_length} characters long"
+            
+            def check_length(password: str) -> Optional[str]:
+                return length_error if len(password) < min_length else None
+            
+            checks.append(check_length)
+        
+        need = ((_UPPER if self.require_uppercase else 0) |
+                (_LOWER if self.require_lowercase else 0) |
+                (_DIGIT if self.require_numbers else 0) |
+                (_SPECIAL if self.require_special_chars else 0))
+        
+        if need:
+            class_errors = [(bit, message) for bit, message in _CLASS_ERRORS if need & bit]
+            
+            def check_classes(password: str) -> Optional[str]:
+                seen = 0
+                if password.isascii():
+                    # Map every byte to its class bit in C and combine the distinct bits
+                    for bit in set(password.encode("ascii").translate(_ASCII_CLASSES)):
+                        seen |= bit
+                    if seen & need == need:
+                        return None
+                else:
+                    # Classify characters in a single pass, stopping once every required class is seen
+                    for c in password:
+                        seen |= _classify(c)
+                        if seen & need == need:
+                            return None
+                
+                for bit, message in class_errors:
+                    if not seen & bit:
+                        return message
+                
+                return None
+            
+            checks.append(check_classes)
+        
+        return checks
     
-    def is_password_expired(self, last_change_date: datetime) -> bool:
+    def is_password_expired(self, last_change_date: Union[datetime, float]) -> bool:
         """
         Check if a password is expired.
         
         Args:
-            last_change_date: The date the password was last changed.
+            last_change_date: The date the password was last changed, as a datetime
+                or seconds since the epoch.
             
         Returns:
             True if the password is expired, False otherwise.
@@ -97,8 +296,10 @@ class PasswordPolicy:
         if self.max_age_days <= 0:
             return False
         
-        expiry_date = last_change_date + timedelta(days=self.max_age_days)
-        return datetime.now() > expiry_date
+        if isinstance(last_change_date, datetime):
+            last_change_date = last_change_date.timestamp()
+        
+        return time.time() > last_change_date + self.max_age_days * 86400
     
     def can_reuse_password(self, new_password: str, password_history: List[Dict[str, str]]) -> bool:
         """
@@ -117,15 +318,68 @@ class PasswordPolicy:
         # Check only the most recent passwords up to prevent_reuse
         recent_passwords = password_history[-self.prevent_reuse:] if password_history else []
         
-        for old_password in recent_passwords:
-            if PasswordHasher.verify_password(
-                new_password, 
-                old_password["hash"], 
-                old_password["salt"]
-            ):
+        # Entries with a different fingerprint under the current pepper cannot
+        # match, so skip their KDF check. Entries fingerprinted with another
+        # pepper, or none, still get the full check.
+        if self.history_pepper:
+            fingerprint = self.history_fingerprint(new_password)
+            pepper_id = self.history_pepper_id()
+            
+            recent_passwords = [
+                old for old in recent_passwords
+                if not old.get("peppered_sha256")
+                or old.get("pepper_id") != pepper_id
+                or hmac.compare_digest(old["peppered_sha256"], fingerprint)
+            ]
+        
+        if len(recent_passwords) <= 1:
+            return not any(
+                PasswordHasher.verify_password(new_password, old["hash"], old["salt"])
+                for old in recent_passwords
+            )
+        
+        futures = [
+            _history_executor.submit(
+                PasswordHasher.verify_password, new_password, old["hash"], old["salt"]
+            )
+            for old in recent_passwords
+        ]
+        
+        for future in as_completed(futures):
+            if future.result():
+                # Skip checks that have not started yet
+                for pending in futures:
+                    pending.cancel()
                 return False
         
         return True
+    
+    def history_fingerprint(self, password: str) -> Optional[str]:
+        """
+        Get the fingerprint stored with a password history entry.
+        
+        Args:
+            password: The password.
+            
+        Returns:
+            The peppered fingerprint of the password, or None if no pepper is configured.
+        """
+        if not self.history_pepper:
+            return None
+        
+        return PasswordHasher.fingerprint(password, self.history_pepper)
+    
+    def history_pepper_id(self) -> Optional[str]:
+        """
+        Get the identifier of the pepper stored with history fingerprints.
+        
+        Returns:
+            A non-secret identifier of the current pepper, or None if no pepper is configured.
+        """
+        if not self.history_pepper:
+            return None
+        
+        return PasswordHasher.fingerprint("password-history-pepper-id", self.history_pepper)[:16]
 
 class PasswordAuthProvider(AuthProvider):
     """
@@ -137,7 +391,9 @@ class PasswordAuthProvider(AuthProvider):
                 session_storage: SessionStorage,
                 password_policy: Optional[PasswordPolicy] = None,
                 session_duration_minutes: int = 60,
-                remember_me_duration_days: int = 30):
+                remember_me_duration_days: int = 30,
+                activity_write_interval: int = 60,
+                clock: Optional[Callable[[], datetime]] = None):
         """
         Initialize the password authentication provider.
         
@@ -147,15 +403,33 @@ class PasswordAuthProvider(AuthProvider):
             password_policy: The password policy.
             session_duration_minutes: The session duration in minutes.
             remember_me_duration_days: The "remember me" session duration in days.
+            activity_write_interval: Minimum number of seconds between persisted last_activity updates.
+            clock: Returns the current time when no request time is set. Defaults to datetime.now.
         """
         self.user_storage = user_storage
         self.session_storage = session_storage
         self.password_policy = password_policy or PasswordPolicy()
         self.session_duration_minutes = session_duration_minutes
         self.remember_me_duration_days = remember_me_duration_days
+        self.activity_write_interval = activity_write_interval
+        self._clock = clock or datetime.now
+        
+        # Validated sessions: session_id -> (expires_at_ts, last_activity_ts)
+        self._session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS)
+        
+        # User IDs by username: username -> user_id
+        self._user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+        
+        # Rejected credentials: (username, password digest) -> True
+        self._failed_login_cache = TTLCache(
+            maxsize=FAILED_LOGIN_CACHE_SIZE, ttl=FAILED_LOGIN_CACHE_TTL_SECONDS
+        )
         
-        # Failed login attempts tracking
-        self.failed_attempts = {}  # username -> {"count": int, "last_attempt": datetime}
+        # Failed login attempts tracking, dropped once the lockout window has passed
+        self.failed_attempts = TTLCache(maxsize=FAILED_ATTEMPTS_SIZE)  # username -> (count, last_attempt_ts)
+        self._failed_filter = bytearray(FAILED_FILTER_BITS // 8)
+        self._failed_filter_inserts = 0
+        self._failed_lock = threading.Lock()
     
     def authenticate(self, credentials: Dict[str, Any]) -> AuthResult:
         """
@@ -186,8 +460,18 @@ class PasswordAuthProvider(AuthProvider):
                 message=f"Account is locked due to too many failed login attempts. Try again later."
             )
         
+        # Refuse credentials that were just rejected without running the KDF again
+        failed_login_key = self._failed_login_key(username, password)
+        if failed_login_key in self._failed_login_cache:
+            self._record_failed_attempt(username)
+            
+            return AuthResult(
+                status=AuthStatus.FAILURE,
+                message="Invalid username or password"
+            )
+        
         # Find user by username
-        user = self.user_storage.find_by_username(username)
+        user = self._find_by_username(username)
         if not user:
             # Record failed attempt
             self._record_failed_attempt(username)
@@ -213,6 +497,7 @@ class PasswordAuthProvider(AuthProvider):
         if not PasswordHasher.verify_password(password, password_hash, salt):
             # Record failed attempt
             self._record_failed_attempt(username)
+            self._failed_login_cache[failed_login_key] = True
             
             return AuthResult(
                 status=AuthStatus.FAILURE,
@@ -222,11 +507,20 @@ class PasswordAuthProvider(AuthProvider):
         # Reset failed attempts
         self._reset_failed_attempts(username)
         
+        # Transparently upgrade legacy or outdated password hashes
+        if PasswordHasher.needs_rehash(password_hash):
+            new_password_hash, new_salt = PasswordHasher.hash_password(password)
+            user_credentials["password_hash"] = new_password_hash
+            user_credentials["salt"] = new_salt
+            user["credentials"] = user_credentials
+            
+            if not self.user_storage.update(user["id"], user):
+                logger.warning(f"Failed to upgrade password hash for user {username}")
+        
         # Check if password is expired
-        last_password_change = user_credentials.get("last_password_change")
-        if last_password_change:
-            last_change_date = datetime.fromisoformat(last_password_change)
-            if self.password_policy.is_password_expired(last_change_date):
+        last_password_change = get_record_timestamp(user_credentials, "last_password_change")
+        if last_password_change is not None:
+            if self.password_policy.is_password_expired(last_password_change):
                 return AuthResult(
                     status=AuthStatus.EXPIRED,
                     user_id=user["id"],
@@ -247,21 +541,8 @@ class PasswordAuthProvider(AuthProvider):
         # Create session
         session = self._create_session(user["id"], ip_address, user_agent, remember_me)
         
-        # Store session
-        session_dict = {
-            "session_id": session.session_id,
-            "user_id": session.user_id,
-            "created_at": session.created_at.isoformat(),
-            "expires_at": session.expires_at.isoformat(),
-            "ip_address": session.ip_address,
-            "user_agent": session.user_agent,
-            "is_active": session.is_active,
-            "last_activity": datetime.now().isoformat(),
-            "mfa_verified": session.mfa_verified,
-            "metadata": session.metadata
-        }
-        
-        if not self.session_storage.create(session.session_id, session_dict):
+        # Store session, leaving out fields that still hold their defaults
+        if not self.session_storage.create(session.to_storage_dict(minimal=True)):
             logger.error(f"Failed to create session for user {username}")
             return AuthResult(
                 status=AuthStatus.FAILURE,
@@ -285,26 +566,36 @@ class PasswordAuthProvider(AuthProvider):
         Returns:
             True if the session is valid, False otherwise.
         """
-        session = self.session_storage.get(session_id)
-        if not session:
-            return False
+        cached = self._session_cache.get(session_id)
+        if cached is None:
+            session = self.session_storage.get(session_id)
+            if not session:
+                return False
+            
+            # Check if session is active
+            if not session.get("is_active", False):
+                return False
+            
+            expiration = get_record_timestamp(session, "expires_at")
+            if expiration is None:
+                return False
+            
+            last_activity = get_record_timestamp(session, "last_activity") or 0
+            cached = (expiration, last_activity)
+            self._session_cache[session_id] = cached
         
-        # Check if session is active
-        if not session.get("is_active", False):
-            return False
+        expiration, last_activity = cached
         
         # Check if session has expired
-        expires_at = session.get("expires_at")
-        if not expires_at:
-            return False
-        
-        expiration = datetime.fromisoformat(expires_at)
-        if datetime.now() > expiration:
+        now = self._now().timestamp()
+        if now > expiration:
+            self._session_cache.pop(session_id)
             return False
         
-        # Update last activity
-        session["last_activity"] = datetime.now().isoformat()
-        self.session_storage.update(session_id, session)
+        # Update last activity, persisting at most once per write interval
+        if now - last_activity >= self.activity_write_interval:
+            self.session_storage.update_many({session_id: {"last_activity_ts": now}})
+            self._session_cache[session_id] = (expiration, now)
         
         return True
     
@@ -324,6 +615,7 @@ class PasswordAuthProvider(AuthProvider):
         
         # Mark session as inactive
         session["is_active"] = False
+        self._session_cache.pop(session_id)
         
         return self.session_storage.update(session_id, session)
     
@@ -345,7 +637,7 @@ class PasswordAuthProvider(AuthProvider):
             return None
         
         # Check if username already exists
-        existing_user = self.user_storage.find_by_username(username)
+        existing_user = self._find_by_username(username)
         if existing_user:
             logger.error(f"Username '{username}' already exists")
             return None
@@ -358,31 +650,29 @@ class PasswordAuthProvider(AuthProvider):
         
         # Hash password
         password_hash, salt = PasswordHasher.hash_password(password)
+        now = self._now()
         
         # Create credentials
-        credentials = {
-            "username": username,
-            "password_hash": password_hash,
-            "salt": salt,
-            "last_password_change": datetime.now().isoformat(),
-            "password_history": [],
-            "mfa_enabled": False,
-            "api_keys": []
-        }
+        credentials = _CREDENTIALS_TEMPLATE.copy()
+        credentials["username"] = username
+        credentials["password_hash"] = password_hash
+        credentials["salt"] = salt
+        credentials["last_password_change"] = now
+        credentials["last_password_change_ts"] = now.timestamp()
+        credentials["password_history"] = []
+        credentials["api_keys"] = []
         
         # Create user
-        user = {
-            "username": username,
-            "email": user_data.get("email"),
-            "first_name": user_data.get("first_name"),
-            "last_name": user_data.get("last_name"),
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
-            "credentials": credentials,
-            "roles": user_data.get("roles", []),
-            "is_active": True,
-            "metadata": user_data.get("metadata", {})
-        }
+        user = _USER_TEMPLATE.copy()
+        user["username"] = username
+        user["email"] = user_data.get("email")
+        user["first_name"] = user_data.get("first_name")
+        user["last_name"] = user_data.get("last_name")
+        user["created_at"] = now
+        user["updated_at"] = now
+        user["credentials"] = credentials
+        user["roles"] = user_data.get("roles", [])
+        user["metadata"] = user_data.get("metadata", {})
         
         return self.user_storage.create(user)
     
@@ -409,7 +699,9 @@ class PasswordAuthProvider(AuthProvider):
                 user[key] = value
         
         # Update timestamp
-        user["updated_at"] = datetime.now().isoformat()
+        user["updated_at"] = self._now()
+        
+        self.invalidate_user(user_id)
         
         return self.user_storage.update(user_id, user)
     
@@ -423,6 +715,8 @@ class PasswordAuthProvider(AuthProvider):
         Returns:
             True if the deletion was successful, False otherwise.
         """
+        self.invalidate_user(user_id)
+        
         return self.user_storage.delete(user_id)
     
     def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
@@ -447,7 +741,7 @@ class PasswordAuthProvider(AuthProvider):
         Returns:
             The user data, or None if the user was not found.
         """
-        return self.user_storage.find_by_username(username)
+        return self._find_by_username(username)
     
     def change_password(self, user_id: str, old_password: str, new_password: str) -> bool:
         """
@@ -496,11 +790,16 @@ class PasswordAuthProvider(AuthProvider):
         new_password_hash, new_salt = PasswordHasher.hash_password(new_password)
         
         # Update password history
-        password_history.append({
+        history_entry = {
             "hash": password_hash,
             "salt": salt,
             "changed_at": credentials.get("last_password_change")
-        })
+        }
+        fingerprint = self.password_policy.history_fingerprint(old_password)
+        if fingerprint:
+            history_entry["peppered_sha256"] = fingerprint
+            history_entry["pepper_id"] = self.password_policy.history_pepper_id()
+        password_history.append(history_entry)
         
         # Keep only the most recent passwords
         if len(password_history) > self.password_policy.prevent_reuse:
@@ -509,12 +808,17 @@ class PasswordAuthProvider(AuthProvider):
         # Update credentials
         credentials["password_hash"] = new_password_hash
         credentials["salt"] = new_salt
-        credentials["last_password_change"] = datetime.now().isoformat()
+        now = self._now()
+        credentials["last_password_change"] = now
+        credentials["last_password_change_ts"] = now.timestamp()
         credentials["password_history"] = password_history
         
         # Update user
         user["credentials"] = credentials
-        user["updated_at"] = datetime.now().isoformat()
+        user["updated_at"] = now
+        
+        self._forget_failed_logins(credentials.get("username") or user.get("username"))
+        self.invalidate_user(user_id)
         
         return self.user_storage.update(user_id, user)
     
@@ -548,11 +852,16 @@ class PasswordAuthProvider(AuthProvider):
         credentials = user.get("credentials", {})
         credentials["password_hash"] = new_password_hash
         credentials["salt"] = new_salt
-        credentials["last_password_change"] = datetime.now().isoformat()
+        now = self._now()
+        credentials["last_password_change"] = now
+        credentials["last_password_change_ts"] = now.timestamp()
         
         # Update user
         user["credentials"] = credentials
-        user["updated_at"] = datetime.now().isoformat()
+        user["updated_at"] = now
+        
+        self._forget_failed_logins(credentials.get("username") or user.get("username"))
+        self.invalidate_user(user_id)
         
         return self.user_storage.update(user_id, user)
     
@@ -567,7 +876,7 @@ class PasswordAuthProvider(AuthProvider):
             The password reset token, or None if generation failed.
         """
         # Find user by username
-        user = self.user_storage.find_by_username(username)
+        user = self._find_by_username(username)
         if not user:
             logger.error(f"User with username '{username}' not found")
             return None
@@ -576,14 +885,17 @@ class PasswordAuthProvider(AuthProvider):
         token = TokenGenerator.generate_token()
         
         # Store token with expiration
-        expiration = datetime.now() + timedelta(hours=24)
+        expiration = self._now() + timedelta(hours=24)
         
         # Update user with reset token
         user["reset_token"] = {
             "token": token,
-            "expires_at": expiration.isoformat()
+            "expires_at": expiration,
+            "expires_at_ts": expiration.timestamp()
         }
         
+        self.invalidate_user(user["id"])
+        
         if not self.user_storage.update(user["id"], user):
             logger.error(f"Failed to update user with reset token")
             return None
@@ -611,14 +923,13 @@ class PasswordAuthProvider(AuthProvider):
         
         # Check if token has expired
         reset_token = user.get("reset_token", {})
-        expires_at = reset_token.get("expires_at")
+        expiration = get_record_timestamp(reset_token, "expires_at")
         
-        if not expires_at:
+        if expiration is None:
             logger.error(f"Reset token has no expiration")
             return None
         
-        expiration = datetime.fromisoformat(expires_at)
-        if datetime.now() > expiration:
+        if self._now().timestamp() > expiration:
             logger.error(f"Reset token has expired")
             return None
         
@@ -639,7 +950,7 @@ class PasswordAuthProvider(AuthProvider):
             The created session.
         """
         session_id = TokenGenerator.generate_session_id()
-        created_at = datetime.now()
+        created_at = self._now()
         
         # Set expiration based on remember_me
         if remember_me:
@@ -661,6 +972,82 @@ class PasswordAuthProvider(AuthProvider):
         
         return session
     
+    def _now(self) -> datetime:
+        """
+        Get the current time, shared by everything done for one request.
+        
+        Returns:
+            The request time if the web layer set one, otherwise the clock's time.
+        """
+        return get_request_time(self._clock)
+    
+    def _find_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a user by username, using the in-memory user ID cache.
+        
+        Args:
+            username: The username to search for.
+            
+        Returns:
+            The user data, or None if the user was not found.
+        """
+        user_id = self._user_cache.get(username)
+        if user_id is not None:
+            user = self.user_storage.get(user_id)
+            
+            # The user may have been deleted or renamed elsewhere
+            if user and user.get("username") == username:
+                return user
+            
+            self._user_cache.pop(username)
+        
+        user = self.user_storage.find_by_username(username)
+        if user and "id" in user:
+            self._user_cache[username] = user["id"]
+        
+        return user
+    
+    def invalidate_user(self, user_id: str) -> None:
+        """
+        Drop the cached username lookup of a user.
+        
+        Must be called after the user is changed outside this provider.
+        
+        Args:
+            user_id: The user ID.
+        """
+        self._user_cache.evict(lambda _, cached_id: cached_id == user_id)
+    
+    @staticmethod
+    def _failed_login_key(username: str, password: str) -> Tuple[str, bytes]:
+        """
+        Get the rejected-credentials cache key for a login attempt.
+        
+        Args:
+            username: The username.
+            password: The password.
+            
+        Returns:
+            The username and a keyed digest of the password.
+        """
+        digest = hashlib.blake2b(
+            password.encode(), key=_FAILED_LOGIN_CACHE_KEY, digest_size=16
+        ).digest()
+        return username, digest
+    
+    def _forget_failed_logins(self, username: Optional[str]) -> None:
+        """
+        Drop rejected credentials cached for a username.
+        
+        Must be called when the user's password changes, since a previously
+        wrong password may now be correct.
+        
+        Args:
+            username: The username.
+        """
+        if username:
+            self._failed_login_cache.evict(lambda key, _: key[0] == username)
+    
     def _is_account_locked(self, username: str) -> bool:
         """
         Check if an account is locked due to too many failed login attempts.
@@ -671,20 +1058,25 @@ class PasswordAuthProvider(AuthProvider):
         Returns:
             True if the account is locked, False otherwise.
         """
-        if username not in self.failed_attempts:
-            return False
+        # Users who never failed a login are never in the filter. Their
+        # failures can't be counted while tracking is full, so fail closed.
+        if not self._in_failed_filter(username):
+            return self.failed_attempts.is_full()
         
-        attempts = self.failed_attempts[username]
+        attempts = self.failed_attempts.get(username)
+        if attempts is None:
+            return self.failed_attempts.is_full()
+        
+        count, last_attempt = attempts
         
         # Check if number of attempts exceeds the limit
-        if attempts["count"] < self.password_policy.max_failed_attempts:
+        if count < self.password_policy.max_failed_attempts:
             return False
         
         # Check if lockout period has expired
-        last_attempt = attempts["last_attempt"]
-        lockout_expiry = last_attempt + timedelta(minutes=self.password_policy.lockout_duration_minutes)
+        lockout_expiry = last_attempt + self.password_policy.lockout_duration_minutes * 60
         
-        if datetime.now() > lockout_expiry:
+        if self._now().timestamp() > lockout_expiry:
             # Reset attempts if lockout period has expired
             self._reset_failed_attempts(username)
             return False
@@ -698,16 +1090,71 @@ class PasswordAuthProvider(AuthProvider):
         Args:
             username: The username to record the attempt for.
         """
-        now = datetime.now()
+        now = self._now().timestamp()
         
-        if username not in self.failed_attempts:
-            self.failed_attempts[username] = {
-                "count": 1,
-                "last_attempt": now
-            }
-        else:
-            self.failed_attempts[username]["count"] += 1
-            self.failed_attempts[username]["last_attempt"] = now
+        # Update the filter and the cache together so a rebuild never misses an entry
+        with self._failed_lock:
+            count, _ = self.failed_attempts.get(username, (0, None))
+            
+            # Keep the entry until the lockout window after this attempt has
+            # passed; never push out another username that is still tracked
+            if not self.failed_attempts.add(
+                username, (count + 1, now),
+                ttl=self.password_policy.lockout_duration_minutes * 60
+            ):
+                logger.warning(f"Failed login tracking is full, treating {username} as locked")
+                return
+            
+            if self._failed_filter_inserts >= FAILED_ATTEMPTS_SIZE:
+                self._rebuild_failed_filter()
+            
+            for position in self._failed_filter_positions(username):
+                self._failed_filter[position >> 3] |= 1 << (position & 7)
+            self._failed_filter_inserts += 1
+    
+    @staticmethod
+    def _failed_filter_positions(username: str) -> Tuple[int, int]:
+        """
+        Get the Bloom filter bits for a username.
+        
+        Args:
+            username: The username.
+            
+        Returns:
+            Two bit positions derived from the username's hash.
+        """
+        h = hash(username)
+        return h & (FAILED_FILTER_BITS - 1), (h >> 32) & (FAILED_FILTER_BITS - 1)
+    
+    def _in_failed_filter(self, username: str) -> bool:
+        """
+        Check whether a username may have failed attempts.
+        
+        Args:
+            username: The username.
+            
+        Returns:
+            False if the username definitely has no tracked attempts.
+        """
+        failed_filter = self._failed_filter
+        return all(
+            failed_filter[position >> 3] & (1 << (position & 7))
+            for position in self._failed_filter_positions(username)
+        )
+    
+    def _rebuild_failed_filter(self) -> None:
+        """
+        Rebuild the Bloom filter from the tracked usernames.
+        
+        Must be called with the failed attempts lock held.
+        """
+        failed_filter = bytearray(FAILED_FILTER_BITS // 8)
+        for username in self.failed_attempts.keys():
+            for position in self._failed_filter_positions(username):
+                failed_filter[position >> 3] |= 1 << (position & 7)
+        
+        self._failed_filter = failed_filter
+        self._failed_filter_inserts = 0
     
     def _reset_failed_attempts(self, username: str) -> None:
         """
@@ -716,5 +1163,4 @@ class PasswordAuthProvider(AuthProvider):
         Args:
             username: The username to reset attempts for.
         """
-        if username in self.failed_attempts:
-            del self.failed_attempts[username]
+        self.failed_attempts.pop(username)
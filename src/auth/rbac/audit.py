@@ -5,23 +5,117 @@ Audit logging for RBAC operations.
 import logging
 import json
 import os
+import queue
 import time
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Optional, Union, Tuple, Iterator
 from datetime import datetime
 import uuid
 import threading
+from collections import deque
 
 from .core import ResourceType, PermissionLevel
 
+try:
+    import orjson
+    # One event per line; like the stdlib, accept non-string keys in role changes
+    _ORJSON_OPTIONS = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+def _json_default(value: Any) -> Any:
+    """Encode values the stdlib encoder doesn't support, matching orjson."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _encode_events(events: List[Dict[str, Any]]) -> bytes:
+    """Encode events as JSON lines, using orjson when available."""
+    if ORJSON_AVAILABLE:
+        return b"".join(orjson.dumps(event, option=_ORJSON_OPTIONS) for event in events)
+    return "".join(
+        json.dumps(event, separators=(",", ":"), default=_json_default) + '\n' for event in events
+    ).encode('utf-8')
+
+def _pack_events(events: List[Dict[str, Any]]) -> bytes:
+    """Encode events as concatenated msgpack maps."""
+    # Naive timestamps aren't supported by the msgpack timestamp type, so
+    # datetimes are written as ISO strings like in the JSON format.
+    return b"".join(msgpack.packb(event, default=_json_default, use_bin_type=True) for event in events)
+
+# File extension and encoder for each log format
+_LOG_FORMATS = {
+    "json": (".log", _encode_events),
+    "msgpack": (".msgpack", _pack_events),
+}
+
+def iter_log_events(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read the events of an audit log file in either format.
+    
+    Args:
+        path: The path of the log file.
+        
+    Yields:
+        The logged events, in order.
+    """
+    with open(path, 'rb') as f:
+        if path.endswith(".msgpack"):
+            if not MSGPACK_AVAILABLE:
+                raise ImportError("msgpack is required to read msgpack audit logs")
+            yield from msgpack.Unpacker(f, raw=False, strict_map_key=False)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+# Logged names of enum members, looked up instead of going through the enum descriptors
+_RESOURCE_TYPE_VALUES = {member: member.value for member in ResourceType}
+_PERMISSION_LEVEL_NAMES = {member: member.name for member in PermissionLevel}
+
+# Fields of each event type, after the timestamp and event type and before the request ID
+_EVENT_FIELDS = {
+    "permission_check": ("user_id", "resource_type", "resource_id", "required_level",
+                         "granted", "client_ip"),
+    "role_assignment": ("user_id", "role_id", "assigned_by", "client_ip"),
+    "role_removal": ("user_id", "role_id", "removed_by", "client_ip"),
+    "role_creation": ("role_id", "created_by", "client_ip"),
+    "role_update": ("role_id", "updated_by", "changes", "client_ip"),
+    "role_deletion": ("role_id", "deleted_by", "client_ip"),
+    "query_execution": ("user_id", "query_type", "data_source_id", "original_query",
+                        "modified_query", "execution_time_ms", "client_ip")
+}
+
+# Minimum number of seconds between warnings about a full audit queue
+OVERFLOW_REPORT_INTERVAL_SECONDS = 60
+
+# Buffer size of the open log file. The async worker flushes it at most this
+# many seconds after writing, so buffered events reach the file promptly.
+FILE_BUFFER_SIZE = 1 << 20
+FLUSH_INTERVAL_SECONDS = 0.1
+
+# How long a caller waits for room in a full queue before writing itself
+BACKPRESSURE_TIMEOUT_SECONDS = 0.05
+
 class AuditLogger:
     """
     Logs RBAC-related operations for auditing purposes.
     """
     
     def __init__(self, log_dir: str, max_file_size_mb: int = 10, 
-                max_files: int = 10, async_logging: bool = True):
+                max_files: int = 10, async_logging: bool = True,
+                max_queue_size: int = 10000, log_format: str = "json",
+                backpressure_timeout: float = BACKPRESSURE_TIMEOUT_SECONDS):
         """
         Initialize the audit logger.
         
@@ -30,26 +124,61 @@ class AuditLogger:
             max_file_size_mb: The maximum size of a log file in MB.
             max_files: The maximum number of log files to keep.
             async_logging: Whether to log asynchronously.
+            max_queue_size: The maximum number of events waiting for the async worker.
+                Callers write further events themselves until the worker catches up.
+            log_format: The file format, "json" for JSON lines or "msgpack".
+            backpressure_timeout: How long a caller waits for room in a full queue
+                before writing the queued events and its own event itself.
         """
         self.log_dir = log_dir
         self.max_file_size = max_file_size_mb * 1024 * 1024  # Convert to bytes
         self.max_files = max_files
         self.async_logging = async_logging
+        self.max_queue_size = max_queue_size
+        self.backpressure_timeout = backpressure_timeout
+        
+        if log_format == "msgpack" and not MSGPACK_AVAILABLE:
+            logger.warning("msgpack is not installed, writing audit logs as JSON lines")
+            log_format = "json"
+        elif log_format not in _LOG_FORMATS:
+            logger.warning(f"Unknown audit log format '{log_format}', writing JSON lines")
+            log_format = "json"
+        self.log_format = log_format
+        self._log_extension, self._encode = _LOG_FORMATS[log_format]
         
         # Create log directory if it doesn't exist
         os.makedirs(log_dir, exist_ok=True)
         
+        # Existing log files, oldest first; kept up to date by rotation
+        self._log_files = deque(sorted(
+            f for f in os.listdir(log_dir) if f.startswith("rbac_audit_") and f.endswith(self._log_extension)
+        ))
+        
         # Current log file
-        self.current_log_file = os.path.join(log_dir, f"rbac_audit_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+        self.current_log_file = os.path.join(log_dir, f"rbac_audit_{datetime.now().strftime('%Y%m%d_%H%M%S')}{self._log_extension}")
         
         # Lock for thread safety
         self.lock = threading.Lock()
         
+        # Open handle on the current log file and its size, set on first write
+        self._file = None
+        self._file_size = 0
+        
         # Queue for async logging
         if async_logging:
-            self.queue = []
-            self.queue_lock = threading.Lock()
-            self.stop_event = threading.Event()
+            # SimpleQueue is implemented in C, so put() takes no Python-level lock.
+            # Events are only taken off it with the lock held, so events written
+            # by callers can't overtake queued ones.
+            self.queue = queue.SimpleQueue()
+            
+            # Wakes the worker when events are queued; signalled when the worker frees queue space
+            self._wakeup = threading.Event()
+            self._stopping = threading.Event()
+            self._not_full = threading.Condition()
+            
+            # Events written by callers because the queue was full, since the last warning
+            self._overflow_count = 0
+            self._overflow_reported_at = time.monotonic()
             self.worker_thread = threading.Thread(target=self._log_worker)
             self.worker_thread.daemon = True
             self.worker_thread.start()
@@ -70,19 +199,10 @@ class AuditLogger:
             client_ip: The client IP address.
             request_id: The request ID.
         """
-        event = {
-            "timestamp": datetime.now().isoformat(),
-            "event_type": "permission_check",
-            "user_id": user_id,
-            "resource_type": resource_type.value,
-            "resource_id": resource_id,
-            "required_level": required_level.name,
-            "granted": granted,
-            "client_ip": client_ip,
-            "request_id": request_id or str(uuid.uuid4())
-        }
-        
-        self._log_event(event)
+        self._log_event("permission_check", (
+            user_id, _RESOURCE_TYPE_VALUES[resource_type], resource_id,
+            _PERMISSION_LEVEL_NAMES[required_level], granted, client_ip
+        ), request_id)
     
     def log_role_assignment(self, user_id: str, role_id: str, 
                           assigned_by: str, client_ip: Optional[str] = None,
@@ -97,17 +217,7 @@ class AuditLogger:
             client_ip: The client IP address.
             request_id: The request ID.
         """
-        event = {
-            "timestamp": datetime.now().isoformat(),
-            "event_type": "role_assignment",
-            "user_id": user_id,
-            "role_id": role_id,
-            "assigned_by": assigned_by,
-            "client_ip": client_ip,
-            "request_id": request_id or str(uuid.uuid4())
-        }
-        
-        self._log_event(event)
+        self._log_event("role_assignment", (user_id, role_id, assigned_by, client_ip), request_id)
     
     def log_role_removal(self, user_id: str, role_id: str, 
                        removed_by: str, client_ip: Optional[str] = None,
@@ -122,17 +232,7 @@ class AuditLogger:
             client_ip: The client IP address.
             request_id: The request ID.
         """
-        event = {
-            "timestamp": datetime.now().isoformat(),
-            "event_type": "role_removal",
-            "user_id": user_id,
-            "role_id": role_id,
-            "removed_by": removed_by,
-            "client_ip": client_ip,
-            "request_id": request_id or str(uuid.uuid4())
-        }
-        
-        self._log_event(event)
+        self._log_event("role_removal", (user_id, role_id, removed_by, client_ip), request_id)
     
     def log_role_creation(self, role_id: str, created_by: str, 
                         client_ip: Optional[str] = None,
@@ -146,16 +246,7 @@ class AuditLogger:
             client_ip: The client IP address.
             request_id: The request ID.
         """
-        event = {
-            "timestamp": datetime.now().isoformat(),
-            "event_type": "role_creation",
-            "role_id": role_id,
-            "created_by": created_by,
-            "client_ip": client_ip,
-            "request_id": request_id or str(uuid.uuid4())
-        }
-        
-        self._log_event(event)
+        self._log_event("role_creation", (role_id, created_by, client_ip), request_id)
     
     def log_role_update(self, role_id: str, updated_by: str, 
                       changes: Dict[str, Any], client_ip: Optional[str] = None,
@@ -170,17 +261,7 @@ class AuditLogger:
             client_ip: The client IP address.
             request_id: The request ID.
         """
-        event = {
-            "timestamp": datetime.now().isoformat(),
-            "event_type": "role_update",
-            "role_id": role_id,
-            "updated_by": updated_by,
-            "changes": changes,
-            "client_ip": client_ip,
-            "request_id": request_id or str(uuid.uuid4())
-        }
-        
-        self._log_event(event)
+        self._log_event("role_update", (role_id, updated_by, changes, client_ip), request_id)
     
     def log_role_deletion(self, role_id: str, deleted_by: str, 
                         client_ip: Optional[str] = None,
@@ -194,16 +275,7 @@ class AuditLogger:
             client_ip: The client IP address.
             request_id: The request ID.
         """
-        event = {
-            "timestamp": datetime.now().isoformat(),
-            "event_type": "role_deletion",
-            "role_id": role_id,
-            "deleted_by": deleted_by,
-            "client_ip": client_ip,
-            "request_id": request_id or str(uuid.uuid4())
-        }
-        
-        self._log_event(event)
+        self._log_event("role_deletion", (role_id, deleted_by, client_ip), request_id)
     
     def log_query_execution(self, user_id: str, query_type: str, 
                           data_source_id: str, original_query: str,
@@ -223,106 +295,281 @@ class AuditLogger:
             client_ip: The client IP address.
             request_id: The request ID.
         """
+        self._log_event("query_execution", (
+            user_id, query_type, data_source_id, original_query, modified_query,
+            execution_time_ms, client_ip
+        ), request_id)
+    
+    def _log_event(self, event_type: str, values: Tuple[Any, ...],
+                   request_id: Optional[str]) -> None:
+        """
+        Log an event.
+        
+        Only the time is taken here; the event is formatted by the writer.
+        
+        Args:
+            event_type: The type of event.
+            values: The values of the event type's fields.
+            request_id: The request ID, or None to generate one.
+        """
+        record = (event_type, time.time_ns(), values, request_id)
+        
+        if not self.async_logging:
+            self._write_log(record)
+            return
+        
+        if self.queue.qsize() < self.max_queue_size:
+            self._enqueue(record)
+            return
+        
+        # Give the worker a moment to catch up
+        self._wakeup.set()
+        with self._not_full:
+            has_room = self._not_full.wait_for(
+                lambda: self.queue.qsize() < self.max_queue_size, timeout=self.backpressure_timeout
+            )
+        
+        if has_room:
+            self._enqueue(record)
+            return
+        
+        # Write the queued events ahead of this one to keep the log in order
+        with self.lock:
+            records = self._drain_queue()
+            records.append(record)
+            self._write_records(records)
+        
+        self._report_overflow()
+    
+    def _enqueue(self, record: Tuple[str, int, Tuple[Any, ...], Optional[str]]) -> None:
+        """
+        Queue an event for the worker, waking it if it may be asleep.
+        
+        The worker clears the wakeup event before taking events, so an event
+        queued after it looked is always followed by a wakeup.
+        
+        Args:
+            record: The event record.
+        """
+        self.queue.put(record)
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+    
+    def _report_overflow(self) -> None:
+        """
+        Count an event the caller wrote because the queue stayed full, warning periodically.
+        
+        The count is approximate under concurrent callers.
+        """
+        self._overflow_count += 1
+        
+        now = time.monotonic()
+        if now - self._overflow_reported_at >= OVERFLOW_REPORT_INTERVAL_SECONDS:
+            logger.warning(
+                f"Audit log queue full; {self._overflow_count} events were written "
+                f"synchronously in the last {now - self._overflow_reported_at:.0f}s"
+            )
+            self._overflow_count = 0
+            self._overflow_reported_at = now
+    
+    @staticmethod
+    def _format_event(record: Tuple[str, int, Tuple[Any, ...], Optional[str]]) -> Dict[str, Any]:
+        """
+        Build the logged event from a queued record.
+        
+        Args:
+            record: The event type, time in nanoseconds, field values and request ID.
+            
+        Returns:
+            The event.
+        """
+        event_type, timestamp_ns, values, request_id = record
+        
+        seconds, nanoseconds = divmod(timestamp_ns, 1_000_000_000)
+        
         event = {
-            "timestamp": datetime.now().isoformat(),
-            "event_type": "query_execution",
-            "user_id": user_id,
-            "query_type": query_type,
-            "data_source_id": data_source_id,
-            "original_query": original_query,
-            "modified_query": modified_query,
-            "execution_time_ms": execution_time_ms,
-            "client_ip": client_ip,
-            "request_id": request_id or str(uuid.uuid4())
+            "timestamp": datetime.fromtimestamp(seconds).replace(microsecond=nanoseconds // 1000),
+            "event_type": event_type
         }
+        event.update(zip(_EVENT_FIELDS[event_type], values))
+        event["request_id"] = request_id or uuid.uuid4()
         
-        self._log_event(event)
+        return event
     
-    def _log_event(self, event: Dict[str, Any]) -> None:
+    def _write_log(self, record: Tuple[str, int, Tuple[Any, ...], Optional[str]]) -> None:
         """
-        Log an event.
+        Write an event to the log file.
         
         Args:
-            event: The event to log.
+            record: The queued event record.
         """
-        if self.async_logging:
-            with self.queue_lock:
-                self.queue.append(event)
-        else:
-            self._write_log(event)
+        self._write_batch([record])
     
-    def _write_log(self, event: Dict[str, Any]) -> None:
+    def _write_batch(self, records: List[Tuple[str, int, Tuple[Any, ...], Optional[str]]],
+                     flush: bool = True) -> None:
         """
-        Write an event to the log file.
+        Write events to the log file with a single write.
         
         Args:
-            event: The event to write.
+            records: The queued event records.
+            flush: Whether to flush the file buffer after writing.
         """
         with self.lock:
+            self._write_records(records, flush)
+    
+    def _write_records(self, records: List[Tuple[str, int, Tuple[Any, ...], Optional[str]]],
+                       flush: bool = True) -> None:
+        """
+        Write events to the log file with a single write.
+        
+        Must be called with the lock held.
+        
+        Args:
+            records: The queued event records.
+            flush: Whether to flush the file buffer after writing.
+        """
+        try:
+            payload = self._encode([self._format_event(record) for record in records])
+        except Exception as e:
+            logger.error(f"Error encoding audit events: {e}")
+            return
+        
+        try:
             # Check if we need to rotate the log file
-            if os.path.exists(self.current_log_file) and os.path.getsize(self.current_log_file) >= self.max_file_size:
+            if self._file is not None and self._file_size >= self.max_file_size:
+                self._close_log()
                 self._rotate_logs()
             
-            # Write the event to the log file
+            if self._file is None:
+                self._open_log()
+            
+            # Write the events to the log file
+            self._file.write(payload)
+            if flush:
+                self._file.flush()
+            self._file_size += len(payload)
+        except Exception as e:
+            logger.error(f"Error writing to audit log: {e}")
+    
+    def _drain_queue(self) -> List[Tuple[str, int, Tuple[Any, ...], Optional[str]]]:
+        """
+        Take all queued events.
+        
+        Must be called with the lock held.
+        
+        Returns:
+            The queued event records, oldest first.
+        """
+        records = []
+        while True:
             try:
-                with open(self.current_log_file, 'a') as f:
-                    f.write(json.dumps(event) + '\n')
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                return records
+    
+    def _open_log(self) -> None:
+        """
+        Open the current log file for appending.
+        
+        Must be called with the lock held.
+        """
+        self._file = open(self.current_log_file, 'ab', buffering=FILE_BUFFER_SIZE)
+        self._file_size = self._file.tell()
+        
+        filename = os.path.basename(self.current_log_file)
+        if not self._log_files or self._log_files[-1] != filename:
+            self._log_files.append(filename)
+    
+    def _flush_log(self) -> None:
+        """
+        Flush buffered events to the current log file.
+        """
+        with self.lock:
+            try:
+                if self._file is not None:
+                    self._file.flush()
             except Exception as e:
-                logger.error(f"Error writing to audit log: {e}")
+                logger.error(f"Error flushing audit log: {e}")
+    
+    def _close_log(self) -> None:
+        """
+        Close the current log file.
+        
+        Must be called with the lock held.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
     
     def _rotate_logs(self) -> None:
         """
         Rotate log files.
         """
-        # Get all log files
-        log_files = [f for f in os.listdir(self.log_dir) if f.startswith("rbac_audit_") and f.endswith(".log")]
-        log_files.sort()
+        log_files = self._log_files
         
         # Delete oldest files if we have too many
         while len(log_files) >= self.max_files:
             oldest_file = os.path.join(self.log_dir, log_files[0])
             try:
                 os.remove(oldest_file)
-                log_files.pop(0)
+                log_files.popleft()
+            except FileNotFoundError:
+                log_files.popleft()
             except Exception as e:
                 logger.error(f"Error deleting old audit log file {oldest_file}: {e}")
                 break
         
         # Create a new log file
-        self.current_log_file = os.path.join(self.log_dir, f"rbac_audit_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+        self.current_log_file = os.path.join(self.log_dir, f"rbac_audit_{datetime.now().strftime('%Y%m%d_%H%M%S')}{self._log_extension}")
     
     def _log_worker(self) -> None:
         """
         Worker thread for async logging.
         """
-        while not self.stop_event.is_set():
-            events_to_log = []
+        flushed_at = time.monotonic()
+        unflushed = False
+        
+        while True:
+            stopping = self._stopping.is_set()
+            self._wakeup.clear()
+            
+            # Take and write queued events together, leaving them in the file buffer
+            with self.lock:
+                events_to_log = self._drain_queue()
+                if events_to_log:
+                    self._write_records(events_to_log, flush=False)
+            
+            if events_to_log:
+                unflushed = True
+                with self._not_full:
+                    self._not_full.notify_all()
             
-            # Get events from the queue
-            with self.queue_lock:
-                if self.queue:
-                    events_to_log = self.queue.copy()
-                    self.queue.clear()
+            if stopping:
+                return
             
-            # Log events
-            for event in events_to_log:
-                self._write_log(event)
+            if unflushed and time.monotonic() - flushed_at >= FLUSH_INTERVAL_SECONDS:
+                self._flush_log()
+                flushed_at = time.monotonic()
+                unflushed = False
             
-            # Sleep for a short time
-            time.sleep(0.1)
+            # Block until an event is queued, waking up to flush buffered events
+            if not events_to_log:
+                self._wakeup.wait(FLUSH_INTERVAL_SECONDS if unflushed else None)
     
     def shutdown(self) -> None:
         """
         Shut down the audit logger.
         """
         if self.async_logging:
-            self.stop_event.set()
+            self._stopping.set()
+            self._wakeup.set()
             self.worker_thread.join(timeout=5.0)
             
             # Log any remaining events
-            with self.queue_lock:
-                events_to_log = self.queue.copy()
-                self.queue.clear()
-            
-            for event in events_to_log:
-                self._write_log(event) 
\ No newline at end of file
+            with self.lock:
+                events_to_log = self._drain_queue()
+                if events_to_log:
+                    self._write_records(events_to_log)
+        
+        with self.lock:
+            self._close_log() 
\ No newline at end of file
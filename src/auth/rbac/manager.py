@@ -73,12 +73,18 @@ class RBACManager:
             max_file_size_mb = config.get("max_file_size_mb", 10)
             max_files = config.get("max_files", 10)
             async_logging = config.get("async_logging", True)
+            max_queue_size = config.get("max_queue_size", 10000)
+            log_format = config.get("log_format", "json")
+            backpressure_timeout = config.get("backpressure_timeout", 0.05)
             
             self.audit_logger = AuditLogger(
                 log_dir=log_dir,
                 max_file_size_mb=max_file_size_mb,
                 max_files=max_files,
-                async_logging=async_logging
+                async_logging=async_logging,
+                max_queue_size=max_queue_size,
+                log_format=log_format,
+                backpressure_timeout=backpressure_timeout
             )
         else:
             self.audit_logger = None
@@ -18,7 +18,7 @@ import zlib
 
 from .core import (
     AuthProvider, AuthResult, AuthStatus, UserSession, UserCredentials,
-    TokenGenerator
+    TokenGenerator, get_record_timestamp
 )
 from .storage import UserStorage, SessionStorage
 
@@ -83,7 +83,8 @@ class SAMLAuthProvider(AuthProvider):
                 user_storage: UserStorage,
                 session_storage: SessionStorage,
                 saml_providers: List[SAMLProvider],
-                session_duration_minutes: int = 60):
+                session_duration_minutes: int = 60,
+                activity_write_interval: int = 60):
         """
         Initialize the SAML authentication provider.
         
@@ -92,6 +93,7 @@ class SAMLAuthProvider(AuthProvider):
             session_storage: The session storage.
             saml_providers: The SAML providers.
             session_duration_minutes: The session duration in minutes.
+            activity_write_interval: Minimum number of seconds between persisted last_activity updates.
         """
         if not SAML_AVAILABLE:
             logger.warning("SAML support is not available. Install python3-saml package.")
@@ -100,6 +102,7 @@ class SAMLAuthProvider(AuthProvider):
         self.session_storage = session_storage
         self.saml_providers = {provider.provider_id: provider for provider in saml_providers}
         self.session_duration_minutes = session_duration_minutes
+        self.activity_write_interval = activity_write_interval
         
         # SAML clients
         self.saml_clients = {}
@@ -187,21 +190,15 @@ class SAMLAuthProvider(AuthProvider):
             return False
         
         # Check if session has expired
-        expires_at = session.get("expires_at")
-        if not expires_at:
+        now = time.time()
+        expiration = get_record_timestamp(session, "expires_at")
+        if expiration is None or now > expiration:
             return False
         
-        try:
-            expiration = datetime.fromisoformat(expires_at)
-            if datetime.now() > expiration:
-                return False
-        except Exception as e:
-            logger.error(f"Error parsing expiration date: {e}")
-            return False
-        
-        # Update last activity
-        session["last_activity"] = datetime.now().isoformat()
-        self.session_storage.update(session_id, session)
+        # Update last activity, persisting at most once per write interval
+        last_activity = get_record_timestamp(session, "last_activity") or 0
+        if now - last_activity >= self.activity_write_interval:
+            self.session_storage.update_many({session_id: {"last_activity_ts": now}})
         
         return True
     
@@ -442,20 +439,7 @@ class SAMLAuthProvider(AuthProvider):
             session = self._create_session(user["id"], None, None)
             
             # Store session
-            session_dict = {
-                "session_id": session.session_id,
-                "user_id": session.user_id,
-                "created_at": session.created_at.isoformat(),
-                "expires_at": session.expires_at.isoformat(),
-                "ip_address": session.ip_address,
-                "user_agent": session.user_agent,
-                "is_active": session.is_active,
-                "last_activity": session.last_activity.isoformat() if session.last_activity else None,
-                "mfa_verified": session.mfa_verified,
-                "metadata": session.metadata
-            }
-            
-            if not self.session_storage.create(session_dict):
+            if not self.session_storage.create(session.to_storage_dict()):
                 return AuthResult(
                     status=AuthStatus.FAILURE,
                     message="Failed to create session"
@@ -2,16 +2,61 @@
 Storage providers for authentication data.
 """
 
+import bisect
 import logging
 import json
 import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, List, Any, Optional, Union
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple, Union
 import uuid
 from datetime import datetime
 
+from .cache import TTLCache
+from .core import get_record_timestamp
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# Whether users have MFA enabled, so session checks don't read the user.
+# Writes through this process update the entry; a change made by another
+# process is picked up once the entry expires.
+MFA_CACHE_SIZE = 10000
+MFA_CACHE_TTL_SECONDS = 30
+
+def _json_loads(data: bytes) -> Any:
+    """Decode a stored JSON document, using orjson when available."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_default(value: Any) -> Any:
+    """Encode values the stdlib encoder doesn't support, matching orjson."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _json_dumps(data: Any, pretty: bool = True) -> bytes:
+    """
+    Encode a JSON document for storage, using orjson when available.
+    
+    Datetimes are written as ISO-8601 strings, so callers can store them
+    without formatting them first.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else None)
+    if pretty:
+        return json.dumps(data, indent=2, default=_json_default).encode('utf-8')
+    # Without indent the stdlib uses its C encoder
+    return json.dumps(data, separators=(",", ":"), default=_json_default).encode('utf-8')
+
 class StorageProvider(ABC):
     """
     Abstract base class for storage providers.
@@ -83,23 +128,141 @@ class StorageProvider(ABC):
             A list of items.
         """
         pass
+    
+    def patch(self, id: str, changes: Dict[str, Any]) -> bool:
+        """
+        Update some fields of an item.
+        
+        Keys may be dotted paths ("mfa.totp.verified") to set nested fields;
+        missing intermediate objects are created. The default implementation
+        reads, merges and writes the whole item; providers backed by a
+        database should override it with a partial update.
+        
+        Args:
+            id: The ID of the item to update.
+            changes: The fields to set, by (dotted) key.
+            
+        Returns:
+            True if the update was successful, False otherwise.
+        """
+        data = self.get(id)
+        if data is None:
+            return False
+        
+        for key, value in changes.items():
+            target = data
+            *parents, leaf = key.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[leaf] = value
+        
+        return self.update(id, data)
+    
+    def patch_many(self, changes_by_id: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Update some fields of several items.
+        
+        The default implementation patches items one by one; providers
+        backed by a database should override it with a single bulk update.
+        
+        Args:
+            changes_by_id: The fields to set, by item ID.
+            
+        Returns:
+            The number of items updated.
+        """
+        return sum(1 for id, changes in changes_by_id.items() if self.patch(id, changes))
+    
+    def close(self) -> None:
+        """
+        Release resources held by the provider.
+        
+        The default implementation holds nothing.
+        """
+        pass
 
 class FileStorageProvider(StorageProvider):
     """
     File-based storage provider.
     """
     
-    def __init__(self, directory: str):
+    def __init__(self, directory: str, pretty: bool = True):
         """
         Initialize the file storage provider.
         
         Args:
             directory: The directory to store files in.
+            pretty: Whether to write indented JSON. Compact JSON is much
+                cheaper to encode for frequently rewritten items.
         """
         self.directory = directory
+        self.pretty = pretty
         
         # Create directory if it doesn't exist
         os.makedirs(directory, exist_ok=True)
+        
+        # Keep the directory open so item files are resolved relative to it
+        # instead of walking the full path on every access
+        self._dir_fd = None
+        if os.open in os.supports_dir_fd:
+            self._dir_fd = os.open(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    
+    def close(self) -> None:
+        """
+        Close the directory handle; later accesses use the full path.
+        """
+        dir_fd, self._dir_fd = self._dir_fd, None
+        if dir_fd is not None:
+            os.close(dir_fd)
+    
+    def __del__(self):
+        # __init__ may have failed before the handle was set
+        if getattr(self, "_dir_fd", None) is not None:
+            self.close()
+    
+    def _open(self, filename: str, flags: int) -> int:
+        """
+        Open an item file relative to the storage directory.
+        
+        Args:
+            filename: The name of the file.
+            flags: The os.open flags.
+            
+        Returns:
+            The file descriptor.
+        """
+        if self._dir_fd is not None:
+            return os.open(filename, flags, 0o644, dir_fd=self._dir_fd)
+        return os.open(os.path.join(self.directory, filename), flags, 0o644)
+    
+    def _read(self, filename: str) -> Dict[str, Any]:
+        """
+        Read and decode an item file.
+        
+        Args:
+            filename: The name of the file.
+            
+        Returns:
+            The item.
+        """
+        with open(self._open(filename, os.O_RDONLY), 'rb') as f:
+            return _json_loads(f.read())
+    
+    def _write(self, filename: str, data: Dict[str, Any], create: bool) -> None:
+        """
+        Encode and write an item file.
+        
+        Args:
+            filename: The name of the file.
+            data: The item data.
+            create: Whether to create the file if it doesn't exist.
+        """
+        flags = os.O_WRONLY | os.O_TRUNC
+        if create:
+            flags |= os.O_CREAT
+        
+        with open(self._open(filename, flags), 'wb') as f:
+            f.write(_json_dumps(data, self.pretty))
     
     def get(self, id: str) -> Optional[Dict[str, Any]]:
         """
@@ -113,12 +276,10 @@ class FileStorageProvider(StorageProvider):
         """
         file_path = os.path.join(self.directory, f"{id}.json")
         
-        if not os.path.exists(file_path):
-            return None
-        
         try:
-            with open(file_path, 'r') as f:
-                return json.load(f)
+            return self._read(f"{id}.json")
+        except FileNotFoundError:
+            return None
         except Exception as e:
             logger.error(f"Error reading file {file_path}: {e}")
             return None
@@ -143,8 +304,7 @@ class FileStorageProvider(StorageProvider):
         file_path = os.path.join(self.directory, f"{id}.json")
         
         try:
-            with open(file_path, 'w') as f:
-                json.dump(data, f, indent=2)
+            self._write(f"{id}.json", data, create=True)
             return id
         except Exception as e:
             logger.error(f"Error writing file {file_path}: {e}")
@@ -166,13 +326,11 @@ class FileStorageProvider(StorageProvider):
         
         file_path = os.path.join(self.directory, f"{id}.json")
         
-        if not os.path.exists(file_path):
-            return False
-        
         try:
-            with open(file_path, 'w') as f:
-                json.dump(data, f, indent=2)
+            self._write(f"{id}.json", data, create=False)
             return True
+        except FileNotFoundError:
+            return False
         except Exception as e:
             logger.error(f"Error writing file {file_path}: {e}")
             return False
@@ -189,12 +347,14 @@ class FileStorageProvider(StorageProvider):
         """
         file_path = os.path.join(self.directory, f"{id}.json")
         
-        if not os.path.exists(file_path):
-            return False
-        
         try:
-            os.remove(file_path)
+            if self._dir_fd is not None and os.remove in os.supports_dir_fd:
+                os.remove(f"{id}.json", dir_fd=self._dir_fd)
+            else:
+                os.remove(file_path)
             return True
+        except FileNotFoundError:
+            return False
         except Exception as e:
             logger.error(f"Error deleting file {file_path}: {e}")
             return False
@@ -218,8 +378,7 @@ class FileStorageProvider(StorageProvider):
             file_path = os.path.join(self.directory, filename)
             
             try:
-                with open(file_path, 'r') as f:
-                    item = json.load(f)
+                item = self._read(filename)
                 
                 # Apply filter if provided
                 if filter:
@@ -251,6 +410,9 @@ class UserStorage:
             storage_provider: The storage provider to use.
         """
         self.storage_provider = storage_provider
+        
+        # MFA flags of recently seen users: user_id -> bool
+        self._mfa_enabled = TTLCache(maxsize=MFA_CACHE_SIZE, ttl=MFA_CACHE_TTL_SECONDS)
     
     def get(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -278,7 +440,11 @@ class UserStorage:
         user_data["created_at"] = datetime.now().isoformat()
         user_data["updated_at"] = user_data["created_at"]
         
-        return self.storage_provider.create(None, user_data)
+        user_id = self.storage_provider.create(None, user_data)
+        if user_id:
+            self._track_mfa(user_id, user_data)
+        
+        return user_id
     
     def update(self, user_id: str, user_data: Dict[str, Any]) -> bool:
         """
@@ -294,7 +460,32 @@ class UserStorage:
         # Update updated_at timestamp
         user_data["updated_at"] = datetime.now().isoformat()
         
-        return self.storage_provider.update(user_id, user_data)
+        if not self.storage_provider.update(user_id, user_data):
+            return False
+        
+        self._track_mfa(user_id, user_data)
+        return True
+    
+    def patch(self, user_id: str, changes: Dict[str, Any]) -> bool:
+        """
+        Update some fields of a user.
+        
+        Args:
+            user_id: The ID of the user to update.
+            changes: The fields to set; keys may be dotted paths to nested fields.
+            
+        Returns:
+            True if the update was successful, False otherwise.
+        """
+        changes = dict(changes)
+        changes["updated_at"] = datetime.now().isoformat()
+        
+        if not self.storage_provider.patch(user_id, changes):
+            return False
+        
+        if "mfa_enabled" in changes:
+            self._track_mfa(user_id, changes)
+        return True
     
     def delete(self, user_id: str) -> bool:
         """
@@ -306,7 +497,45 @@ class UserStorage:
         Returns:
             True if the deletion was successful, False otherwise.
         """
-        return self.storage_provider.delete(user_id)
+        if not self.storage_provider.delete(user_id):
+            return False
+        
+        self._mfa_enabled.pop(user_id)
+        return True
+    
+    def is_mfa_enabled(self, user_id: str) -> bool:
+        """
+        Check whether a user has MFA enabled.
+        
+        The answer is cached for MFA_CACHE_TTL_SECONDS, so MFA enabled by
+        another process may take that long to be required here.
+        
+        Args:
+            user_id: The ID of the user.
+            
+        Returns:
+            True if the user has MFA enabled, False otherwise.
+        """
+        mfa_enabled = self._mfa_enabled.get(user_id)
+        if mfa_enabled is not None:
+            return mfa_enabled
+        
+        user = self.storage_provider.get(user_id)
+        if not user:
+            return False
+        
+        self._track_mfa(user_id, user)
+        return bool(user.get("mfa_enabled", False))
+    
+    def _track_mfa(self, user_id: str, user_data: Dict[str, Any]) -> None:
+        """
+        Keep the cached MFA flag in sync with a read or written user.
+        
+        Args:
+            user_id: The ID of the user.
+            user_data: The user data that was read or written.
+        """
+        self._mfa_enabled[user_id] = bool(user_data.get("mfa_enabled", False))
     
     def list(self, filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
@@ -320,6 +549,12 @@ class UserStorage:
         """
         return self.storage_provider.list(filter)
     
+    def close(self) -> None:
+        """
+        Release resources held by the storage provider.
+        """
+        self.storage_provider.close()
+    
     def find_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """
         Find a user by username.
@@ -387,6 +622,13 @@ class SessionStorage:
             storage_provider: The storage provider to use.
         """
         self.storage_provider = storage_provider
+        
+        # Sorted (expires_at, session_id) pairs, built on first cleanup. Entries
+        # superseded by a later update stay in the list until they expire and
+        # are skipped unless they match _expiry_by_id.
+        self._expiry_index: Optional[List[Tuple[float, str]]] = None
+        self._expiry_by_id: Dict[str, float] = {}
+        self._expiry_lock = threading.Lock()
     
     def get(self, session_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -412,7 +654,11 @@ class SessionStorage:
         """
         session_id = session_data.get("session_id")
         
-        return self.storage_provider.create(session_id, session_data)
+        session_id = self.storage_provider.create(session_id, session_data)
+        if session_id:
+            self._index_expiry(session_id, session_data)
+        
+        return session_id
     
     def update(self, session_id: str, session_data: Dict[str, Any]) -> bool:
         """
@@ -425,7 +671,32 @@ class SessionStorage:
         Returns:
             True if the update was successful, False otherwise.
         """
-        return self.storage_provider.update(session_id, session_data)
+        if not self.storage_provider.update(session_id, session_data):
+            return False
+        
+        self._index_expiry(session_id, session_data)
+        return True
+    
+    def update_many(self, changes_by_id: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Update some fields of several sessions at once.
+        
+        Args:
+            changes_by_id: The fields to set, by session ID.
+            
+        Returns:
+            The number of sessions updated.
+        """
+        updated_count = self.storage_provider.patch_many(changes_by_id)
+        
+        # Only re-index sessions whose expiry was changed
+        for session_id, changes in changes_by_id.items():
+            if "expires_at" in changes or "expires_at_ts" in changes:
+                session = self.storage_provider.get(session_id)
+                if session:
+                    self._index_expiry(session_id, session)
+        
+        return updated_count
     
     def delete(self, session_id: str) -> bool:
         """
@@ -437,6 +708,9 @@ class SessionStorage:
         Returns:
             True if the deletion was successful, False otherwise.
         """
+        with self._expiry_lock:
+            self._expiry_by_id.pop(session_id, None)
+        
         return self.storage_provider.delete(session_id)
     
     def list(self, filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
@@ -451,6 +725,12 @@ class SessionStorage:
         """
         return self.storage_provider.list(filter)
     
+    def close(self) -> None:
+        """
+        Release resources held by the storage provider.
+        """
+        self.storage_provider.close()
+    
     def find_by_user_id(self, user_id: str) -> List[Dict[str, Any]]:
         """
         Find sessions by user ID.
@@ -467,24 +747,290 @@ class SessionStorage:
         """
         Clean up expired sessions.
         
+        Only sessions whose indexed expiry has passed are touched, so the
+        cost is proportional to the number of expired sessions rather than
+        the total number of stored sessions.
+        
         Returns:
             The number of sessions deleted.
         """
-        all_sessions = self.storage_provider.list()
-        now = datetime.now()
+        now = time.time()
+        
+        with self._expiry_lock:
+            if self._expiry_index is None:
+                self._build_expiry_index()
+            
+            cutoff = bisect.bisect_left(self._expiry_index, now, key=lambda entry: entry[0])
+            expired = self._expiry_index[:cutoff]
+            del self._expiry_index[:cutoff]
+            
+            expired_ids = []
+            for expiration, session_id in expired:
+                # Skip entries superseded by a later update
+                if self._expiry_by_id.get(session_id) == expiration:
+                    del self._expiry_by_id[session_id]
+                    expired_ids.append(session_id)
+        
         deleted_count = 0
         
-        for session in all_sessions:
-            expires_at = session.get("expires_at")
+        for session_id in expired_ids:
+            if self.storage_provider.delete(session_id):
+                deleted_count += 1
+        
+        return deleted_count
+    
+    def rebuild_expiry_index(self) -> None:
+        """
+        Rebuild the expiry index from storage.
+        
+        Needed only when sessions are written to the same storage by another
+        process, since the index tracks writes made through this instance.
+        """
+        with self._expiry_lock:
+            self._build_expiry_index()
+    
+    def _build_expiry_index(self) -> None:
+        """
+        Build the expiry index with a single scan of all sessions.
+        
+        Must be called with _expiry_lock held.
+        """
+        self._expiry_by_id = {}
+        
+        for session in self.storage_provider.list():
+            expiration = get_record_timestamp(session, "expires_at")
+            if expiration is not None and "id" in session:
+                self._expiry_by_id[session["id"]] = expiration
+        
+        self._expiry_index = sorted(
+            (expiration, session_id) for session_id, expiration in self._expiry_by_id.items()
+        )
+    
+    def _index_expiry(self, session_id: str, session_data: Dict[str, Any]) -> None:
+        """
+        Record the expiry of a written session in the index.
+        
+        Args:
+            session_id: The ID of the session.
+            session_data: The session data that was written.
+        """
+        expiration = get_record_timestamp(session_data, "expires_at")
+        
+        with self._expiry_lock:
+            if self._expiry_index is None:
+                return
             
-            if expires_at:
-                try:
-                    expiration = datetime.fromisoformat(expires_at)
-                    
-                    if now > expiration:
-                        if self.storage_provider.delete(session["id"]):
-                            deleted_count += 1
-                except Exception as e:
-                    logger.error(f"Error parsing expiration date: {e}")
+            if expiration is None:
+                self._expiry_by_id.pop(session_id, None)
+                return
+            
+            if self._expiry_by_id.get(session_id) == expiration:
+                return
+            
+            self._expiry_by_id[session_id] = expiration
+            bisect.insort(self._expiry_index, (expiration, session_id))
+
+class StateStore(ABC):
+    """
+    Store for short-lived authorization flow state, such as OAuth state and PKCE verifiers.
+    
+    Shared backends let a flow started on one worker finish on another.
+    """
+    
+    @abstractmethod
+    def put(self, key: str, data: Dict[str, Any], ttl: float) -> bool:
+        """
+        Store state under a new key.
+        
+        Args:
+            key: The state key.
+            data: The state data; must be JSON-serializable.
+            ttl: The number of seconds after which the state expires.
+            
+        Returns:
+            True if the state was stored, False otherwise.
+        """
+        pass
+    
+    @abstractmethod
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Atomically get and remove state.
+        
+        Args:
+            key: The state key.
+            
+        Returns:
+            The state data, or None if it is missing or expired.
+        """
+        pass
+    
+    def purge_expired(self) -> int:
+        """
+        Drop expired state.
+        
+        Backends that expire keys themselves don't need to do anything.
+        
+        Returns:
+            The number of entries dropped.
+        """
+        return 0
+
+class MemoryStateStore(StateStore):
+    """
+    In-process state store, bounded in size.
+    
+    Only suitable when a flow always returns to the same process.
+    """
+    
+    def __init__(self, max_entries: int = 10000):
+        """
+        Initialize the memory state store.
+        
+        Args:
+            max_entries: The maximum number of unexpired entries; new entries are
+                refused beyond it so flows already in progress aren't dropped.
+        """
+        self.max_entries = max_entries
+        
+        # key -> (expires_at as time.monotonic(), data), in insertion order
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.RLock()
+    
+    def put(self, key: str, data: Dict[str, Any], ttl: float) -> bool:
+        now = time.monotonic()
+        
+        with self._lock:
+            self._purge_expired(now)
+            
+            if len(self._entries) >= self.max_entries:
+                logger.warning("Authorization state store is full, refusing new state")
+                return False
+            
+            self._entries[key] = (now + ttl, data)
+        
+        return True
+    
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        
+        if entry is None or time.monotonic() > entry[0]:
+            return None
+        
+        return entry[1]
+    
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge_expired(time.monotonic())
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _purge_expired(self, now: float) -> int:
+        """
+        Drop expired entries from the front.
+        
+        All entries share the caller's TTL in practice, so this stops at the
+        first one that hasn't expired. Must be called with the lock held.
+        
+        Args:
+            now: The current time.monotonic() value.
+            
+        Returns:
+            The number of entries dropped.
+        """
+        purged = 0
+        
+        while self._entries:
+            expires_at, _ = next(iter(self._entries.values()))
+            if expires_at > now:
+                break
+            
+            self._entries.popitem(last=False)
+            purged += 1
+        
+        return purged
+
+class RedisStateStore(StateStore):
+    """
+    State store backed by Redis.
+    """
+    
+    def __init__(self, client: Any, prefix: str = "auth_state:"):
+        """
+        Initialize the Redis state store.
+        
+        Args:
+            client: A redis.Redis client.
+            prefix: The prefix for state keys.
+        """
+        self.client = client
+        self.prefix = prefix
+    
+    def put(self, key: str, data: Dict[str, Any], ttl: float) -> bool:
+        try:
+            # NX: never overwrite a state that is already in flight
+            return bool(self.client.set(
+                self.prefix + key, _json_dumps(data, pretty=False), ex=max(1, int(ttl)), nx=True
+            ))
+        except Exception as e:
+            logger.error(f"Error storing state in Redis: {e}")
+            return False
+    
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            # GET and DEL in one MULTI transaction, so only one caller gets the state
+            pipeline = self.client.pipeline()
+            pipeline.get(self.prefix + key)
+            pipeline.delete(self.prefix + key)
+            value, _ = pipeline.execute()
+        except Exception as e:
+            logger.error(f"Error reading state from Redis: {e}")
+            return None
+        
+        if value is None:
+            return None
+        
+        return _json_loads(value)
+
+class MemcachedStateStore(StateStore):
+    """
+    State store backed by Memcached.
+    """
+    
+    def __init__(self, client: Any, prefix: str = "auth_state:"):
+        """
+        Initialize the Memcached state store.
+        
+        Args:
+            client: A pymemcache Client (or HashClient).
+            prefix: The prefix for state keys.
+        """
+        self.client = client
+        self.prefix = prefix
+    
+    def put(self, key: str, data: Dict[str, Any], ttl: float) -> bool:
+        try:
+            # add only stores keys that don't exist yet
+            return bool(self.client.add(
+                self.prefix + key, _json_dumps(data, pretty=False), expire=max(1, int(ttl)), noreply=False
+            ))
+        except Exception as e:
+            logger.error(f"Error storing state in Memcached: {e}")
+            return False
+    
+    def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = self.client.get(self.prefix + key)
+            if value is None:
+                return None
+            
+            # Whoever deletes the key owns the state; a concurrent pop gets None
+            if not self.client.delete(self.prefix + key, noreply=False):
+                return None
+        except Exception as e:
+            logger.error(f"Error reading state from Memcached: {e}")
+            return None
         
-        return deleted_count 
\ No newline at end of file
+        return _json_loads(value)